@@ -1,11 +1,13 @@
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template, send_from_directory, jsonify
 import os
 from config import Config
-from app.utils.db import init_db
+from app.utils.db import init_db, get_db, get_pool, get_writer
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config:
+        app.config.update(config)
 
     # Initialize database
     init_db(app)
@@ -21,11 +23,30 @@ def create_app():
     app.register_blueprint(mutuals_bp)
     app.register_blueprint(admin_bp)
 
+    # Register CLI commands
+    from app.utils.similarity import compute_matches_command, compute_related_command
+    app.cli.add_command(compute_matches_command)
+    app.cli.add_command(compute_related_command)
+    from app.utils.minhash import rebuild_lsh_command
+    app.cli.add_command(rebuild_lsh_command)
+    from app.utils.query_plans import check_query_plans_command
+    app.cli.add_command(check_query_plans_command)
+
     # Add route to serve uploaded files
     @app.route('/uploads/<filename>')
     def uploaded_file(filename):
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+    # Health check with connection pool and writer usage
+    @app.route('/health')
+    def health():
+        try:
+            get_db().execute('SELECT 1').fetchone()
+            status, code = 'ok', 200
+        except Exception as e:
+            status, code = f'error: {e}', 503
+        return jsonify({'status': status, 'db_pool': get_pool().stats(), 'db_writer': get_writer().stats()}), code
+
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from app.utils.db import get_db
-from app.utils.helpers import validate_required_fields, validate_email, validate_image_url, hash_password, check_password
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from app.utils.db import get_db, run_write, execute_write, TREND_FOLLOWS
+from app.utils.helpers import validate_required_fields, validate_email, validate_image_url, hash_password, check_password, update_global_trends, sync_interest_items
+from app.utils.ingest import empty_interests
+from app.utils.minhash import update_user_minhash
+from app.utils.matching import refresh_user_matches
+from app.utils.related import refresh_item_related
 import sqlite3
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -42,15 +46,11 @@ def edit_profile():
         flash('Invalid image URL format', 'error')
         return redirect(url_for('admin.dashboard'))
 
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        cursor.execute(
+        execute_write(
             'UPDATE users SET username = ?, email = ?, bio = ?, profile_image_url = ? WHERE id = ?',
             (username, email, bio, profile_image_url, user_id)
         )
-        db.commit()
         session['username'] = username
         flash('Profile updated successfully!', 'success')
     except sqlite3.IntegrityError:
@@ -90,11 +90,10 @@ def change_password():
         flash('Current password is incorrect', 'error')
         return redirect(url_for('admin.dashboard'))
 
-    cursor.execute(
+    execute_write(
         'UPDATE users SET password_hash = ? WHERE id = ?',
         (hash_password(new_password), user_id)
     )
-    db.commit()
 
     flash('Password changed successfully!', 'success')
     return redirect(url_for('admin.dashboard'))
@@ -120,12 +119,33 @@ def delete_account():
         flash('Incorrect password', 'error')
         return redirect(url_for('admin.dashboard'))
 
-    # Delete user data
-    cursor.execute('DELETE FROM follows WHERE follower_id = ? OR following_id = ?', (user_id, user_id))
-    cursor.execute('DELETE FROM user_interests WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM activity_logs WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-    db.commit()
+    config = current_app.config
+    num_perm, bands, top_n = config['MINHASH_PERMUTATIONS'], config['LSH_BANDS'], config['MATCHES_TOP_N']
+    related_n = config['RELATED_TOP_N']
+
+    def delete_user_data(cursor):
+        # Withdraw the user's contributions from global trends
+        update_global_trends(cursor, user_id, empty_interests())
+
+        # Delete user data
+        cursor.execute('DELETE FROM follows WHERE follower_id = ? OR following_id = ?', (user_id, user_id))
+        # Through the triggers, so trend_stats.followers drops with each row
+        for table, _, _, _ in TREND_FOLLOWS:
+            cursor.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM user_interests WHERE user_id = ?', (user_id,))
+        _, removed = sync_interest_items(cursor, user_id, empty_interests())
+        cursor.execute('DELETE FROM profile_tags WHERE user_id = ?', (user_id,))
+        update_user_minhash(cursor, user_id, num_perm, bands)
+        refresh_user_matches(cursor, user_id, top_n)
+        cursor.execute('DELETE FROM user_matches_state WHERE user_id = ?', (user_id,))
+        refresh_item_related(cursor, user_id, set(), removed, related_n)
+        cursor.execute('DELETE FROM export_members WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM ingest_jobs WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM activity_logs WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        cursor.execute('DELETE FROM cache_versions WHERE name = ?', (f'foryou:{user_id}',))
+
+    run_write(delete_user_data)
 
     session.clear()
     flash('Account deleted successfully', 'success')
@@ -1,6 +1,7 @@
+import sqlite3
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.utils.db import get_db
+from app.utils.db import get_db, execute_write
 from app.utils.helpers import validate_required_fields, validate_email, hash_password, check_password
 
 auth_bp = Blueprint('auth', __name__)
@@ -56,15 +57,11 @@ def register():
             flash('Password must be at least 6 characters long', 'error')
             return redirect(url_for('auth.register'))
 
-        db = get_db()
-        cursor = db.cursor()
-
         try:
-            cursor.execute(
+            execute_write(
                 'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
                 (username, email, hash_password(password))
             )
-            db.commit()
             flash('Account created successfully! Please log in.', 'success')
             return redirect(url_for('auth.login'))
         except sqlite3.IntegrityError:
@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
-from app.utils.db import get_db
-from app.utils.helpers import process_zip_file
-import os
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app,
+                   Response, stream_with_context)
+from app.utils.db import get_db, run_write, execute_write, FOLLOW_COUNTERS, TREND_FOLLOWS
+from app.utils.helpers import (save_upload, get_user_interests, get_follow_counts, normalize_tag,
+                               sync_profile_tags, encode_cursor, decode_cursor)
+from app.utils.cache import cache_version, trend_listing, conditional_page
+from app.utils.recommend import feed_version, foryou_feed
+from app.utils.related import related_items
+from app.utils.graph import follow_graph
+from app.utils.jobs import enqueue_ingest_job, get_job, get_pending_job, is_duplicate_upload
+from itertools import islice
 import json
+import os
+import sqlite3
+import time
+import uuid
 
 main_bp = Blueprint('main', __name__)
 
@@ -21,48 +32,26 @@ def landing():
 
 @main_bp.route('/home')
 def home():
-    db = get_db()
-    cursor = db.cursor()
-
     # Get query parameters for sorting and filtering
     sort_by = request.args.get('sort', 'popular')
     filter_by = request.args.get('filter', 'all')
 
-    # Base query for global trends
-    base_query = 'SELECT * FROM global_trends'
-    where_clauses = []
-    params = []
-
-    # Apply filter
-    if filter_by != 'all':
-        where_clauses.append('trend_type = ?')
-        params.append(filter_by)
+    # Cached per (sort, filter) until the trends change
+    version = cache_version('trends')
 
-    # Build the query
-    if where_clauses:
-        query = f"{base_query} WHERE {' AND '.join(where_clauses)}"
-    else:
-        query = base_query
+    def render():
+        trends = trend_listing(sort_by, filter_by, version)
 
-    # Apply sorting
-    if sort_by == 'recent':
-        query += ' ORDER BY last_updated DESC'
-    elif sort_by == 'alphabetical':
-        query += ' ORDER BY name ASC'
-    else:  # popular (default)
-        query += ' ORDER BY count DESC'
+        # Group by type
+        hashtags = [t for t in trends if t['trend_type'] == 'hashtag']
+        music = [t for t in trends if t['trend_type'] == 'music']
+        creators = [t for t in trends if t['trend_type'] == 'creator']
 
-    query += ' LIMIT 20'
+        return render_template('home.html', hashtags=hashtags, music=music, creators=creators, sort_by=sort_by, filter_by=filter_by)
 
-    cursor.execute(query, params)
-    trends = cursor.fetchall()
-
-    # Group by type
-    hashtags = [t for t in trends if t['trend_type'] == 'hashtag']
-    music = [t for t in trends if t['trend_type'] == 'music']
-    creators = [t for t in trends if t['trend_type'] == 'creator']
-
-    return render_template('home.html', hashtags=hashtags, music=music, creators=creators, sort_by=sort_by, filter_by=filter_by)
+    # Trending scores also decay over time, so that ETag turns over with the cache TTL
+    slot = int(time.time() // current_app.config['TRENDS_CACHE_TTL']) if sort_by == 'trending' else None
+    return conditional_page(render, 'home', version, sort_by, filter_by, slot)
 
 @main_bp.route('/foryou')
 def foryou():
@@ -81,16 +70,18 @@ def foryou():
         flash('Please upload your activity logs to see personalized recommendations.', 'info')
         return redirect(url_for('main.profile'))
 
-    # Get personalized trends based on user's interests
-    # For simplicity, we'll show global trends but could be filtered by user interests
-    cursor.execute('SELECT * FROM global_trends ORDER BY count DESC LIMIT 20')
-    trends = cursor.fetchall()
+    # Rank trends against the user's interests, matches and follows
+    version = feed_version(user_id)
 
-    hashtags = [t for t in trends if t['trend_type'] == 'hashtag']
-    music = [t for t in trends if t['trend_type'] == 'music']
-    creators = [t for t in trends if t['trend_type'] == 'creator']
+    def render():
+        feed = foryou_feed(user_id, version)
+        return render_template('foryou.html', hashtags=feed['hashtag'], music=feed['music'], creators=feed['creator'],
+                               user_interests=user_interests)
 
-    return render_template('foryou.html', hashtags=hashtags, music=music, creators=creators, user_interests=user_interests)
+    # Peers and popularity also drift without a version change, so the ETag
+    # turns over with the feed cache's TTL
+    slot = int(time.time() // current_app.config['FORYOU_CACHE_TTL'])
+    return conditional_page(render, 'foryou', version, slot, tuple(user_interests))
 
 @main_bp.route('/profile', methods=['GET', 'POST'])
 def profile():
@@ -110,10 +101,14 @@ def profile():
 
             # Update bio and hashtags
             hashtags = request.form.get('hashtags', '').strip()
-            cursor.execute(
-                'UPDATE users SET bio = ?, profile_hashtags = ? WHERE id = ?',
-                (bio, hashtags, user_id)
-            )
+            def save_profile(cursor):
+                cursor.execute(
+                    'UPDATE users SET bio = ?, profile_hashtags = ? WHERE id = ?',
+                    (bio, hashtags, user_id)
+                )
+                sync_profile_tags(cursor, user_id, hashtags)
+
+            run_write(save_profile)
 
             # Handle profile image upload if provided
             if profile_image and profile_image.filename != '':
@@ -128,12 +123,11 @@ def profile():
                 profile_image.save(filepath)
 
                 # Update user profile image
-                cursor.execute(
+                execute_write(
                     'UPDATE users SET profile_image_url = ? WHERE id = ?',
                     (f"/uploads/{filename}", user_id)
                 )
 
-            db.commit()
             flash('Profile updated successfully', 'success')
         elif 'activity_log' in request.files:
             # Handle activity log upload
@@ -146,27 +140,20 @@ def profile():
                 flash('Only .zip files are allowed', 'error')
                 return redirect(request.url)
 
-            # Save file
-            filename = f"user_{user_id}_{file.filename}"
+            # Save file under a unique name so concurrent uploads from the same user don't collide
+            filename = f"user_{user_id}_{uuid.uuid4().hex}_{file.filename}"
             filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-
-            # Process the zip file
-            success, message = process_zip_file(filepath, user_id)
-            if success:
-                # Mark as processed in activity_logs
-                cursor.execute(
-                    'INSERT INTO activity_logs (user_id, zip_filename, processed) VALUES (?, ?, ?)',
-                    (user_id, filename, True)
-                )
-                db.commit()
-                flash(message, 'success')
-            else:
-                flash(message, 'error')
+            content_hash = save_upload(file, filepath)
 
-            # Clean up uploaded file
-            if os.path.exists(filepath):
+            # Skip processing if this is the same export as the last one
+            if is_duplicate_upload(user_id, content_hash):
                 os.remove(filepath)
+                flash('These activity logs are identical to your last upload, your data is already up to date.', 'info')
+                return redirect(url_for('main.profile'))
+
+            # Queue the zip file for background processing
+            enqueue_ingest_job(user_id, filepath, filename, content_hash)
+            flash('Activity logs uploaded! We are processing them now, this page will update when they are ready.', 'info')
 
         return redirect(url_for('main.profile'))
 
@@ -174,27 +161,33 @@ def profile():
     cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
     user = cursor.fetchone()
 
-    cursor.execute('SELECT * FROM user_interests WHERE user_id = ?', (user_id,))
-    interests = cursor.fetchone()
+    interests = get_user_interests(user_id)
 
-    cursor.execute('SELECT COUNT(*) as followers FROM follows WHERE following_id = ?', (user_id,))
-    followers = cursor.fetchone()['followers']
+    followers, following = get_follow_counts(user_id)
 
-    cursor.execute('SELECT COUNT(*) as following FROM follows WHERE follower_id = ?', (user_id,))
-    user_following = cursor.fetchone()['following']
+    # Check for an upload that is still being processed
+    pending_job = get_pending_job(user_id)
 
-    cursor.execute('SELECT COUNT(*) as hashtag_following FROM hashtag_follows WHERE user_id = ?', (user_id,))
-    hashtag_following = cursor.fetchone()['hashtag_following']
+    return render_template('profile.html', user=user, interests=interests, followers=followers, following=following, pending_job=pending_job)
 
-    cursor.execute('SELECT COUNT(*) as music_following FROM music_follows WHERE user_id = ?', (user_id,))
-    music_following = cursor.fetchone()['music_following']
-
-    cursor.execute('SELECT COUNT(*) as creator_following FROM creator_follows WHERE user_id = ?', (user_id,))
-    creator_following = cursor.fetchone()['creator_following']
+@main_bp.route('/api/jobs/<int:job_id>')
+def get_job_status(job_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Not logged in'}), 401
 
-    following = user_following + hashtag_following + music_following + creator_following
+    job = get_job(job_id, user_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
 
-    return render_template('profile.html', user=user, interests=interests, followers=followers, following=following)
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'message': job['message'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    })
 
 @main_bp.route('/user/<int:user_id>')
 def user_detail(user_id):
@@ -212,128 +205,178 @@ def user_detail(user_id):
         flash('User not found', 'error')
         return redirect(url_for('main.home'))
 
-    cursor.execute('SELECT * FROM user_interests WHERE user_id = ?', (user_id,))
-    interests_row = cursor.fetchone()
-
-    # Convert sqlite3.Row to dict for template access and parse JSON
-    interests = None
-    if interests_row:
-        interests = {
-            'hashtags': json.loads(interests_row['hashtags']) if interests_row['hashtags'] else [],
-            'music_liked': json.loads(interests_row['music_liked']) if interests_row['music_liked'] else [],
-            'celebrities_followed': json.loads(interests_row['celebrities_followed']) if interests_row['celebrities_followed'] else [],
-            'posts_liked_count': interests_row['posts_liked_count'],
-            'reels_watched_count': interests_row['reels_watched_count'],
-            'comments_made_count': interests_row['comments_made_count']
-        }
+    interests = get_user_interests(user_id)
 
     # Check if current user follows this user
-    cursor.execute('SELECT * FROM follows WHERE follower_id = ? AND following_id = ?', (current_user_id, user_id))
-    is_following = cursor.fetchone() is not None
-
-    # Get followers count
-    cursor.execute('SELECT COUNT(*) as followers FROM follows WHERE following_id = ?', (user_id,))
-    followers = cursor.fetchone()['followers']
-
-    # Get following count (users + hashtags + music)
-    cursor.execute('SELECT COUNT(*) as user_following FROM follows WHERE follower_id = ?', (user_id,))
-    user_following = cursor.fetchone()['user_following']
-
-    cursor.execute('SELECT COUNT(*) as hashtag_following FROM hashtag_follows WHERE user_id = ?', (user_id,))
-    hashtag_following = cursor.fetchone()['hashtag_following']
-
-    cursor.execute('SELECT COUNT(*) as music_following FROM music_follows WHERE user_id = ?', (user_id,))
-    music_following = cursor.fetchone()['music_following']
-
-    cursor.execute('SELECT COUNT(*) as creator_following FROM creator_follows WHERE user_id = ?', (user_id,))
-    creator_following = cursor.fetchone()['creator_following']
+    is_following = follow_graph().is_following(current_user_id, user_id)
 
-    following = user_following + hashtag_following + music_following + creator_following
+    # Get followers and following (users + hashtags + music + creators) counts
+    followers, following = get_follow_counts(user_id)
 
     return render_template('user_detail.html', user=user, interests=interests, is_following=is_following, followers=followers, following=following)
 
+# Avatar shown in the user list APIs for users without a profile image
+DEFAULT_AVATAR = 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48Y2lyY2xlIGN4PSIzMCIgY3k9IjMwIiByPSIzMCIgZmlsbD0iI2NjYyIvPjwvc3ZnPg=='
+
+# Kinds in the /api/following list, in the order they sort among equal
+# names, with the table each comes from and its user_stats counter
+FOLLOWING_SOURCES = (('user', 'follows'),) + tuple((trend_type, table) for table, _, trend_type, _ in TREND_FOLLOWS)
+FOLLOWING_KINDS = tuple(kind for kind, _ in FOLLOWING_SOURCES)
+FOLLOWING_COUNTERS = {
+    kind: next(counter for counter_table, column, counter in FOLLOW_COUNTERS
+               if counter_table == table and column != 'following_id')
+    for kind, table in FOLLOWING_SOURCES
+}
+
+def _page_args(size):
+    """Read ?limit=, ?cursor= and ?all= for a keyset-paginated list API.
+
+    Returns (limit, after, error). limit is None with ?all=1, which streams
+    the rest of the list; after is the decoded cursor (size values) or None
+    for the first page; error is set when the cursor doesn't decode.
+    """
+    limit = None if request.args.get('all') == '1' else min(max(request.args.get('limit', 50, type=int), 1), 100)
+    after = None
+    if request.args.get('cursor'):
+        after = decode_cursor(request.args['cursor'], size)
+        if after is None:
+            return limit, None, 'Invalid cursor'
+    return limit, after, None
+
+def _list_response(rows, limit, key, to_json):
+    """Respond with rows, an iterable already in cursor order from the requested cursor on.
+
+    With limit None every row is streamed as one JSON array, so the list is
+    never held in memory. Otherwise the first limit rows are returned and
+    X-Next-Cursor carries key() of the last one when more rows follow.
+    """
+    if limit is None:
+        def generate():
+            yield '['
+            for i, row in enumerate(rows):
+                yield (',' if i else '') + json.dumps(to_json(row))
+            yield ']'
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
+    page = list(islice(rows, limit + 1))
+    response = jsonify([to_json(row) for row in page[:limit]])
+    if len(page) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(*key(page[limit - 1]))
+    return response
+
+def _user_json(row):
+    return {
+        'id': row['id'],
+        'username': row['username'],
+        'profile_image_url': row['profile_image_url'] or DEFAULT_AVATAR
+    }
+
+def _user_list(from_where, params):
+    """Page (or stream) the users selected as `u` by from_where, ordered by (username, id)."""
+    limit, after, error = _page_args(2)
+    if error:
+        return jsonify({'error': error}), 400
+
+    keyset = 'AND (u.username, u.id) > (?, ?)' if after else ''
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT u.id, u.username, u.profile_image_url
+        {from_where} {keyset}
+        ORDER BY u.username, u.id
+        LIMIT ?
+    ''', (*params, *(after or ()), -1 if limit is None else limit + 1))
+    return _list_response(cursor, limit, lambda row: (row['username'], row['id']), _user_json)
+
 @main_bp.route('/api/followers/<int:user_id>')
 def get_followers(user_id):
     current_user_id = session.get('user_id')
     if not current_user_id:
         return jsonify({'error': 'Not logged in'}), 401
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute('''
-        SELECT u.id, u.username, u.profile_image_url
+    return _user_list('''
         FROM follows f
         JOIN users u ON f.follower_id = u.id
         WHERE f.following_id = ?
-        ORDER BY u.username
     ''', (user_id,))
 
-    followers = cursor.fetchall()
-    return jsonify([{
-        'id': f['id'],
-        'username': f['username'],
-        'profile_image_url': f['profile_image_url'] or 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48Y2lyY2xlIGN4PSIzMCIgY3k9IjMwIiByPSIzMCIgZmlsbD0iI2NjYyIvPjwvc3ZnPg=='
-    } for f in followers])
-
 @main_bp.route('/api/following/<int:user_id>')
 def get_following(user_id):
     current_user_id = session.get('user_id')
     if not current_user_id:
         return jsonify({'error': 'Not logged in'}), 401
 
-    db = get_db()
-    cursor = db.cursor()
-
-    # Get user following
-    cursor.execute('''
-        SELECT u.id, u.username, u.profile_image_url, 'user' as type
-        FROM follows f
-        JOIN users u ON f.following_id = u.id
-        WHERE f.follower_id = ?
-        ORDER BY u.username
-    ''', (user_id,))
-
-    user_following = cursor.fetchall()
-
-    # Get hashtag following
-    cursor.execute('''
-        SELECT NULL as id, hashtag_name as username, NULL as profile_image_url, 'hashtag' as type
-        FROM hashtag_follows
-        WHERE user_id = ?
-        ORDER BY hashtag_name
-    ''', (user_id,))
-
-    hashtag_following = cursor.fetchall()
-
-    # Get music following
-    cursor.execute('''
-        SELECT NULL as id, song_name as username, NULL as profile_image_url, 'music' as type
-        FROM music_follows
-        WHERE user_id = ?
-        ORDER BY song_name
-    ''', (user_id,))
-
-    music_following = cursor.fetchall()
-
-    # Get creator following
-    cursor.execute('''
-        SELECT NULL as id, creator_name as username, NULL as profile_image_url, 'creator' as type
-        FROM creator_follows
-        WHERE user_id = ?
-        ORDER BY creator_name
-    ''', (user_id,))
-
-    creator_following = cursor.fetchall()
-
-    # Combine and return
-    following = user_following + hashtag_following + music_following + creator_following
-    return jsonify([{
-        'id': f['id'],
-        'username': f['username'],
-        'profile_image_url': f['profile_image_url'] or 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48Y2lyY2xlIGN4PSIzMCIgY3k9IjMwIiByPSIzMCIgZmlsbD0iI2NjYyIvPjwvc3ZnPg==',
-        'type': f['type']
-    } for f in following])
+    # ?type=user,hashtag,... narrows the list to some kinds
+    kinds = set(request.args['type'].split(',')) if request.args.get('type') else set(FOLLOWING_KINDS)
+    if any(kind not in FOLLOWING_KINDS for kind in kinds):
+        return jsonify({'error': 'Invalid type'}), 400
+
+    # Pages run by (name, kind, id) across users and followed trends;
+    # ?cursor= continues after the previous page's last entry
+    limit, after, error = _page_args(3)
+    if error:
+        return jsonify({'error': error}), 400
+    if after and after[1] not in FOLLOWING_KINDS:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    def keyset(kind, name_column, id_column=None):
+        """Condition for the entries of `kind` that sort after the cursor."""
+        if not after:
+            return '', ()
+        name, after_kind, after_id = after
+        if FOLLOWING_KINDS.index(kind) > FOLLOWING_KINDS.index(after_kind):
+            return f'AND {name_column} >= ?', (name,)
+        if kind == after_kind and id_column:
+            return f'AND ({name_column}, {id_column}) > (?, ?)', (name, after_id)
+        return f'AND {name_column} > ?', (name,)
+
+    # One compound query: SQLite sorts each kind off its own index and
+    # merges them for the ORDER BY, which is by result column number (name,
+    # kind_order, id) so it also works when a single kind is selected
+    selects, params = [], []
+    for table, column, trend_type, _ in ((None, None, 'user', None),) + TREND_FOLLOWS:
+        if trend_type not in kinds:
+            continue
+        order = FOLLOWING_KINDS.index(trend_type)
+        if trend_type == 'user':
+            condition, values = keyset('user', 'u.username', 'u.id')
+            selects.append(f'''
+                SELECT u.id, u.username, u.profile_image_url, 'user' as type, {order} as kind_order
+                FROM follows f
+                JOIN users u ON f.following_id = u.id
+                WHERE f.follower_id = ? {condition}
+            ''')
+        else:
+            condition, values = keyset(trend_type, column)
+            selects.append(f'''
+                SELECT NULL as id, {column} as username, NULL as profile_image_url, '{trend_type}' as type, {order} as kind_order
+                FROM {table}
+                WHERE user_id = ? {condition}
+            ''')
+        params += [user_id, *values]
+
+    cursor = get_db().cursor()
+    cursor.execute(' UNION ALL '.join(selects) + ' ORDER BY 2, 5, 1 LIMIT ?',
+                   (*params, -1 if limit is None else limit + 1))
+    response = _list_response(cursor, limit, lambda row: (row['username'], row['type'], row['id']),
+                              lambda row: {**_user_json(row), 'type': row['type']})
+
+    # Size of the whole (filtered) list, from the follow counters
+    stats = get_db().execute(
+        f"SELECT {' + '.join(FOLLOWING_COUNTERS[kind] for kind in kinds)} as total FROM user_stats WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    response.headers['X-Total-Count'] = str(stats['total'] if stats else 0)
+    return response
+
+# A trend's follower and profile-user counts, and its rank: 1 + the number of
+# trends of its type with a higher count, summed over the count histogram
+TREND_STATS_QUERY = '''
+    SELECT ts.followers, ts.profile_users,
+           1 + COALESCE((SELECT SUM(h.trends) FROM trend_count_histogram h
+                         WHERE h.trend_type = ts.trend_type AND h.count > ts.count), 0) as rank
+    FROM trend_stats ts
+    WHERE ts.trend_type = ? AND ts.name = ?
+'''
 
 @main_bp.route('/hashtag/<hashtag_name>')
 def hashtag_detail(hashtag_name):
@@ -347,25 +390,17 @@ def hashtag_detail(hashtag_name):
     # Prepend # to hashtag_name for database query
     full_hashtag_name = '#' + hashtag_name
 
-    # Get hashtag info
-    cursor.execute('SELECT * FROM global_trends WHERE trend_type = ? AND name = ?', ('hashtag', full_hashtag_name))
+    # Get rank, follower and profile-user counts in one query
+    cursor.execute(TREND_STATS_QUERY, ('hashtag', full_hashtag_name))
     hashtag = cursor.fetchone()
 
     if not hashtag:
         flash('Hashtag not found', 'error')
         return redirect(url_for('main.home'))
 
-    # Get rank
-    cursor.execute('SELECT COUNT(*) + 1 as rank FROM global_trends WHERE trend_type = ? AND count > ?', ('hashtag', hashtag['count']))
-    rank = cursor.fetchone()['rank']
-
-    # Get users who have this hashtag in their profile
-    cursor.execute('SELECT COUNT(*) as count FROM users WHERE profile_hashtags LIKE ?', (f'%{hashtag_name}%',))
-    profile_users_count = cursor.fetchone()['count']
-
-    # Get followers count (users following this hashtag)
-    cursor.execute('SELECT COUNT(*) as count FROM hashtag_follows WHERE hashtag_name = ?', (hashtag_name,))
-    followers_count = cursor.fetchone()['count']
+    rank = hashtag['rank']
+    followers_count = hashtag['followers']
+    profile_users_count = hashtag['profile_users']
 
     # Check if current user follows this hashtag
     cursor.execute('SELECT 1 FROM hashtag_follows WHERE user_id = ? AND hashtag_name = ?', (user_id, hashtag_name))
@@ -377,6 +412,9 @@ def hashtag_detail(hashtag_name):
     # Get reels with this hashtag (placeholder data for now)
     reels = []  # This would need a reels table with hashtag associations
 
+    # What people who use this hashtag also like, from the stored item_related list
+    related = related_items('hashtag', hashtag_name)
+
     return render_template('hashtag.html',
                          hashtag_name=hashtag_name,
                          rank=rank,
@@ -384,7 +422,8 @@ def hashtag_detail(hashtag_name):
                          followers_count=followers_count,
                          is_following=is_following,
                          posts=posts,
-                         reels=reels)
+                         reels=reels,
+                         related=related)
 
 @main_bp.route('/hashtag/follow/<hashtag_name>', methods=['POST'])
 def follow_hashtag(hashtag_name):
@@ -392,15 +431,11 @@ def follow_hashtag(hashtag_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        cursor.execute(
+        execute_write(
             'INSERT INTO hashtag_follows (user_id, hashtag_name) VALUES (?, ?)',
             (user_id, hashtag_name)
         )
-        db.commit()
         return jsonify({'success': True, 'message': 'Followed hashtag successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'Already following this hashtag'})
@@ -411,14 +446,10 @@ def unfollow_hashtag(hashtag_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
+    execute_write(
         'DELETE FROM hashtag_follows WHERE user_id = ? AND hashtag_name = ?',
         (user_id, hashtag_name)
     )
-    db.commit()
 
     return jsonify({'success': True, 'message': 'Unfollowed hashtag successfully'})
 
@@ -431,25 +462,17 @@ def music_detail(song_name):
     db = get_db()
     cursor = db.cursor()
 
-    # Get music info from global_trends
-    cursor.execute('SELECT * FROM global_trends WHERE trend_type = ? AND name = ?', ('music', song_name))
+    # Get rank, follower and profile-user counts in one query
+    cursor.execute(TREND_STATS_QUERY, ('music', song_name))
     music = cursor.fetchone()
 
     if not music:
         flash('Song not found', 'error')
         return redirect(url_for('main.home'))
 
-    # Get rank
-    cursor.execute('SELECT COUNT(*) + 1 as rank FROM global_trends WHERE trend_type = ? AND count > ?', ('music', music['count']))
-    rank = cursor.fetchone()['rank']
-
-    # Get users who have this song in their profile
-    cursor.execute('SELECT COUNT(*) as count FROM users WHERE profile_hashtags LIKE ?', (f'%{song_name}%',))
-    profile_users_count = cursor.fetchone()['count']
-
-    # Get followers count (users following this song)
-    cursor.execute('SELECT COUNT(*) as count FROM music_follows WHERE song_name = ?', (song_name,))
-    followers_count = cursor.fetchone()['count']
+    rank = music['rank']
+    followers_count = music['followers']
+    profile_users_count = music['profile_users']
 
     # Check if current user follows this song
     cursor.execute('SELECT 1 FROM music_follows WHERE user_id = ? AND song_name = ?', (user_id, song_name))
@@ -461,6 +484,9 @@ def music_detail(song_name):
     # Get reels with this song (placeholder data for now)
     reels = []  # This would need a reels table with song associations
 
+    # What people who like this song also like, from the stored item_related list
+    related = related_items('music', song_name)
+
     return render_template('music.html',
                          song_name=song_name,
                          rank=rank,
@@ -468,7 +494,8 @@ def music_detail(song_name):
                          followers_count=followers_count,
                          is_following=is_following,
                          posts=posts,
-                         reels=reels)
+                         reels=reels,
+                         related=related)
 
 @main_bp.route('/music/follow/<path:song_name>', methods=['POST'])
 def follow_music(song_name):
@@ -476,15 +503,11 @@ def follow_music(song_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        cursor.execute(
+        execute_write(
             'INSERT INTO music_follows (user_id, song_name) VALUES (?, ?)',
             (user_id, song_name)
         )
-        db.commit()
         return jsonify({'success': True, 'message': 'Followed song successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'Already following this song'})
@@ -495,14 +518,10 @@ def unfollow_music(song_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
+    execute_write(
         'DELETE FROM music_follows WHERE user_id = ? AND song_name = ?',
         (user_id, song_name)
     )
-    db.commit()
 
     return jsonify({'success': True, 'message': 'Unfollowed song successfully'})
 
@@ -518,28 +537,17 @@ def creator_detail(creator_name):
     # Prepend @ to creator_name for database query
     full_creator_name = '@' + creator_name
 
-    # Get creator info from global_trends
-    cursor.execute('SELECT * FROM global_trends WHERE trend_type = ? AND name = ?', ('creator', full_creator_name))
+    # Get rank, follower and profile-user counts in one query
+    cursor.execute(TREND_STATS_QUERY, ('creator', full_creator_name))
     creator = cursor.fetchone()
 
     if not creator:
         flash('Creator not found', 'error')
         return redirect(url_for('main.home'))
 
-    # Update creator name to remove @
-    creator_name = creator_name
-
-    # Get rank
-    cursor.execute('SELECT COUNT(*) + 1 as rank FROM global_trends WHERE trend_type = ? AND count > ?', ('creator', creator['count']))
-    rank = cursor.fetchone()['rank']
-
-    # Get users who have this creator in their profile
-    cursor.execute('SELECT COUNT(*) as count FROM users WHERE profile_hashtags LIKE ?', (f'%{creator_name}%',))
-    profile_users_count = cursor.fetchone()['count']
-
-    # Get followers count (users following this creator)
-    cursor.execute('SELECT COUNT(*) as count FROM creator_follows WHERE creator_name = ?', (creator_name,))
-    followers_count = cursor.fetchone()['count']
+    rank = creator['rank']
+    followers_count = creator['followers']
+    profile_users_count = creator['profile_users']
 
     # Check if current user follows this creator
     cursor.execute('SELECT 1 FROM creator_follows WHERE user_id = ? AND creator_name = ?', (user_id, creator_name))
@@ -551,6 +559,9 @@ def creator_detail(creator_name):
     # Get reels with this creator (placeholder data for now)
     reels = []  # This would need a reels table with creator associations
 
+    # What people who follow this creator also like, from the stored item_related list
+    related = related_items('creator', full_creator_name)
+
     return render_template('creator.html',
                          creator_name=creator_name,
                          rank=rank,
@@ -558,7 +569,8 @@ def creator_detail(creator_name):
                          followers_count=followers_count,
                          is_following=is_following,
                          posts=posts,
-                         reels=reels)
+                         reels=reels,
+                         related=related)
 
 @main_bp.route('/creator/follow/<creator_name>', methods=['POST'])
 def follow_creator(creator_name):
@@ -566,15 +578,11 @@ def follow_creator(creator_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        cursor.execute(
+        execute_write(
             'INSERT INTO creator_follows (user_id, creator_name) VALUES (?, ?)',
             (user_id, creator_name)
         )
-        db.commit()
         return jsonify({'success': True, 'message': 'Followed creator successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'Already following this creator'})
@@ -585,14 +593,10 @@ def unfollow_creator(creator_name):
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
+    execute_write(
         'DELETE FROM creator_follows WHERE user_id = ? AND creator_name = ?',
         (user_id, creator_name)
     )
-    db.commit()
 
     return jsonify({'success': True, 'message': 'Unfollowed creator successfully'})
 
@@ -602,42 +606,16 @@ def get_trend_users(trend_type, trend_name):
     if not current_user_id:
         return jsonify({'error': 'Not logged in'}), 401
 
-    db = get_db()
-    cursor = db.cursor()
-
-    if trend_type == 'hashtag':
-        # Users who have this hashtag in their profile_hashtags
-        cursor.execute('''
-            SELECT id, username, profile_image_url
-            FROM users
-            WHERE profile_hashtags LIKE ?
-            ORDER BY username
-        ''', (f'%{trend_name}%',))
-    elif trend_type == 'music':
-        # Users who have this song in their profile_hashtags (assuming music is stored there)
-        cursor.execute('''
-            SELECT id, username, profile_image_url
-            FROM users
-            WHERE profile_hashtags LIKE ?
-            ORDER BY username
-        ''', (f'%{trend_name}%',))
-    elif trend_type == 'creator':
-        # Users who have this creator in their profile_hashtags
-        cursor.execute('''
-            SELECT id, username, profile_image_url
-            FROM users
-            WHERE profile_hashtags LIKE ?
-            ORDER BY username
-        ''', (f'%{trend_name}%',))
-    else:
+    if trend_type not in ('hashtag', 'music', 'creator'):
         return jsonify({'error': 'Invalid trend type'}), 400
 
-    users = cursor.fetchall()
-    return jsonify([{
-        'id': u['id'],
-        'username': u['username'],
-        'profile_image_url': u['profile_image_url'] or 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48Y2lyY2xlIGN4PSIzMCIgY3k9IjMwIiByPSIzMCIgZmlsbD0iI2NjYyIvPjwvc3ZnPg=='
-    } for u in users])
+    # Users who have this trend in their profile, a page at a time ordered by
+    # (username, id); ?cursor= continues after the previous page's last user
+    return _user_list('''
+        FROM profile_tags pt
+        JOIN users u ON u.id = pt.user_id
+        WHERE pt.tag = ?
+    ''', (normalize_tag(trend_name),))
 
 @main_bp.route('/about')
 def about():
@@ -653,39 +631,13 @@ def get_trend_followers(trend_type, trend_name):
     if not current_user_id:
         return jsonify({'error': 'Not logged in'}), 401
 
-    db = get_db()
-    cursor = db.cursor()
-
-    if trend_type == 'hashtag':
-        cursor.execute('''
-            SELECT u.id, u.username, u.profile_image_url
-            FROM hashtag_follows hf
-            JOIN users u ON hf.user_id = u.id
-            WHERE hf.hashtag_name = ?
-            ORDER BY u.username
-        ''', (trend_name,))
-    elif trend_type == 'music':
-        cursor.execute('''
-            SELECT u.id, u.username, u.profile_image_url
-            FROM music_follows mf
-            JOIN users u ON mf.user_id = u.id
-            WHERE mf.song_name = ?
-            ORDER BY u.username
-        ''', (trend_name,))
-    elif trend_type == 'creator':
-        cursor.execute('''
-            SELECT u.id, u.username, u.profile_image_url
-            FROM creator_follows cf
-            JOIN users u ON cf.user_id = u.id
-            WHERE cf.creator_name = ?
-            ORDER BY u.username
-        ''', (trend_name,))
-    else:
+    follows = {kind: (table, column) for table, column, kind, _ in TREND_FOLLOWS}
+    if trend_type not in follows:
         return jsonify({'error': 'Invalid trend type'}), 400
 
-    users = cursor.fetchall()
-    return jsonify([{
-        'id': u['id'],
-        'username': u['username'],
-        'profile_image_url': u['profile_image_url'] or 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48Y2lyY2xlIGN4PSIzMCIgY3k9IjMwIiByPSIzMCIgZmlsbD0iI2NjYyIvPjwvc3ZnPg=='
-    } for u in users])
+    table, column = follows[trend_type]
+    return _user_list(f'''
+        FROM {table} tf
+        JOIN users u ON tf.user_id = u.id
+        WHERE tf.{column} = ?
+    ''', (trend_name,))
@@ -1,11 +1,29 @@
-import json
 import sqlite3
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from app.utils.db import get_db
-from app.utils.helpers import calculate_interest_match
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from app.utils.db import get_db, run_write
+from app.utils.helpers import get_interest_lists
+from app.utils.matching import approx_top_matches, stored_matches
+from app.utils.graph import follow_graph, record_follow
 
 mutuals_bp = Blueprint('mutuals', __name__, url_prefix='/mutuals')
 
+def users_by_id(user_ids):
+    """Fetch users with follower/following counts, keyed by id in the given order."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    cursor = get_db().cursor()
+    placeholders = ','.join('?' * len(user_ids))
+    cursor.execute(f'''
+        SELECT u.id, u.username, u.profile_image_url,
+               us.followers, us.following
+        FROM users u
+        JOIN user_stats us ON us.user_id = u.id
+        WHERE u.id IN ({placeholders})
+    ''', user_ids)
+    users = {row['id']: row for row in cursor.fetchall()}
+    return {user_id: users[user_id] for user_id in user_ids if user_id in users}
+
 @mutuals_bp.route('/')
 def mutuals():
     user_id = session.get('user_id')
@@ -15,85 +33,77 @@ def mutuals():
     db = get_db()
     cursor = db.cursor()
 
-    # Get query parameter for sorting
+    # Get query parameters for sorting and paging
     sort_by = request.args.get('sort', 'match')
-
-    # Get users with similar interests and follower/following counts
-    cursor.execute('''
-        SELECT u.id, u.username, u.profile_image_url,
-               ui.hashtags, ui.music_liked, ui.celebrities_followed,
-               (SELECT COUNT(*) FROM follows WHERE following_id = u.id) as followers,
-               (SELECT COUNT(*) FROM follows WHERE follower_id = u.id) as following
-        FROM users u
-        LEFT JOIN user_interests ui ON u.id = ui.user_id
-        WHERE u.id != ?
-        ORDER BY u.id
-        LIMIT 20
-    ''', (user_id,))
-
-    users = cursor.fetchall()
-
-    # Process interests to be lists instead of JSON strings
-    processed_users = []
-    for user in users:
-        user_dict = dict(user)  # Convert sqlite3.Row to dict
-
-        # Process hashtags
-        if user_dict['hashtags']:
-            try:
-                user_dict['hashtags'] = json.loads(user_dict['hashtags'])
-            except (json.JSONDecodeError, TypeError):
-                user_dict['hashtags'] = []
-        else:
-            user_dict['hashtags'] = []
-
-        # Process music_liked
-        if user_dict['music_liked']:
-            try:
-                user_dict['music_liked'] = json.loads(user_dict['music_liked'])
-            except (json.JSONDecodeError, TypeError):
-                user_dict['music_liked'] = []
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 20
+    mode = request.args.get('mode', current_app.config['MUTUALS_MODE'])
+
+    if mode == 'approx':
+        # Rank only the LSH candidates, then fetch the users on this page
+        matches, total = approx_top_matches(user_id, per_page, (page - 1) * per_page)
+        users = users_by_id([other_id for other_id, _ in matches])
+        match_percents = dict(matches)
+        users = [dict(users[other_id], match_percent=match_percents[other_id]) for other_id in match_percents]
+        if sort_by == 'followers':
+            users.sort(key=lambda user: user['followers'], reverse=True)
+        elif sort_by == 'alphabetical':
+            users.sort(key=lambda user: user['username'].lower())
+    else:
+        # Read the precomputed matches, sorted and paged in SQL
+        rows, total = stored_matches(user_id, sort_by, per_page, (page - 1) * per_page)
+        users = [dict(row) for row in rows]
+
+    if not users and page == 1:
+        # Nobody shares interests yet, so show some other users to discover
+        cursor.execute('''
+            SELECT id FROM users WHERE id != ? ORDER BY id LIMIT ?
+        ''', (user_id, per_page))
+        others = users_by_id([row['id'] for row in cursor.fetchall()])
+        users = [dict(user, match_percent=0) for user in others.values()]
+
+    # Attach interest lists from the normalized interest table
+    interest_lists = get_interest_lists(user['id'] for user in users)
+    users = [dict(user, **interest_lists[user['id']]) for user in users]
+
+    # Follow status of the whole page in one pass over the follow graph
+    graph = follow_graph()
+    user_ids = [user['id'] for user in users]
+    following = graph.following_among(user_id, user_ids)
+    followers = graph.followers_among(user_id, user_ids)
+    user_matches = [{
+        'user': user,
+        'match_percent': user['match_percent'],
+        'is_following': user['id'] in following,
+        'follows_you': user['id'] in followers
+    } for user in users]
+
+    # Friends of friends to suggest, on the first page only
+    suggestions = []
+    if page == 1:
+        config = current_app.config
+        ranked = dict(graph.suggestions(user_id, config['FOLLOW_SUGGESTIONS'], config['FOLLOW_SUGGESTION_DEPTH']))
+        suggested = users_by_id(ranked)
+        followers = graph.followers_among(user_id, suggested)
+        suggestions = [{'user': user, 'score': ranked[other_id], 'follows_you': other_id in followers}
+                       for other_id, user in suggested.items()]
+
+    has_next = page * per_page < total
+
+    return render_template('mutuals.html', user_matches=user_matches, suggestions=suggestions, sort_by=sort_by,
+                           page=page, has_next=has_next, mode=request.args.get('mode'))
+
+def write_follow(follower_id, following_id, follows):
+    """Insert or delete a follows row and update this process's follow graph."""
+    def write(cursor):
+        if follows:
+            cursor.execute('INSERT INTO follows (follower_id, following_id) VALUES (?, ?)', (follower_id, following_id))
         else:
-            user_dict['music_liked'] = []
-
-        # Process celebrities_followed
-        if user_dict['celebrities_followed']:
-            try:
-                user_dict['celebrities_followed'] = json.loads(user_dict['celebrities_followed'])
-            except (json.JSONDecodeError, TypeError):
-                user_dict['celebrities_followed'] = []
-        else:
-            user_dict['celebrities_followed'] = []
-
-        processed_users.append(user_dict)
-
-    users = processed_users
-
-    # Calculate match percentages and check follow status
-    user_matches = []
-    for user in users:
-        match_percent = calculate_interest_match(user_id, user['id'])
-
-        # Check if current user is following this user
-        cursor.execute('SELECT 1 FROM follows WHERE follower_id = ? AND following_id = ?',
-                      (user_id, user['id']))
-        is_following = cursor.fetchone() is not None
-
-        user_matches.append({
-            'user': user,
-            'match_percent': match_percent,
-            'is_following': is_following
-        })
-
-    # Sort based on the sort parameter
-    if sort_by == 'followers':
-        user_matches.sort(key=lambda x: x['user']['followers'], reverse=True)
-    elif sort_by == 'alphabetical':
-        user_matches.sort(key=lambda x: x['user']['username'].lower())
-    else:  # match (default)
-        user_matches.sort(key=lambda x: x['match_percent'], reverse=True)
+            cursor.execute('DELETE FROM follows WHERE follower_id = ? AND following_id = ?', (follower_id, following_id))
+        cursor.execute("SELECT version FROM cache_versions WHERE name = 'follows'")
+        return cursor.fetchone()[0]
 
-    return render_template('mutuals.html', user_matches=user_matches, sort_by=sort_by)
+    record_follow(follower_id, following_id, follows, run_write(write))
 
 @mutuals_bp.route('/follow/<int:user_id>', methods=['POST'])
 def follow(user_id):
@@ -104,15 +114,8 @@ def follow(user_id):
     if current_user_id == user_id:
         return jsonify({'success': False, 'message': 'Cannot follow yourself'})
 
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        cursor.execute(
-            'INSERT INTO follows (follower_id, following_id) VALUES (?, ?)',
-            (current_user_id, user_id)
-        )
-        db.commit()
+        write_follow(current_user_id, user_id, True)
         return jsonify({'success': True, 'message': 'Followed successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'Already following'})
@@ -123,35 +126,61 @@ def unfollow(user_id):
     if not current_user_id:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute(
-        'DELETE FROM follows WHERE follower_id = ? AND following_id = ?',
-        (current_user_id, user_id)
-    )
-    db.commit()
+    write_follow(current_user_id, user_id, False)
 
     return jsonify({'success': True, 'message': 'Unfollowed successfully'})
 
+def search_users(query, exclude_id, limit=10):
+    """Find users whose username or bio contains query, best matches first.
+
+    Queries of three or more characters go through the user_search trigram
+    index: usernames starting with the query come first, then bm25 rank with
+    username hits weighted over bio hits. Shorter queries can't form a
+    trigram: username prefixes come first off the NOCASE index, and the
+    rest of the page is filled with usernames or bios containing the query,
+    walking users in username order until the page is full.
+    """
+    cursor = get_db().cursor()
+    if len(query) < 3:
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        cursor.execute('''
+            SELECT id, username, profile_image_url
+            FROM users
+            WHERE username LIKE ? ESCAPE '\\' AND id != ?
+            ORDER BY username COLLATE NOCASE
+            LIMIT ?
+        ''', (escaped + '%', exclude_id, limit))
+        users = cursor.fetchall()
+        if len(users) < limit:
+            cursor.execute('''
+                SELECT id, username, profile_image_url
+                FROM users
+                WHERE (username LIKE ?1 ESCAPE '\\' OR bio LIKE ?1 ESCAPE '\\')
+                  AND NOT username LIKE ?2 ESCAPE '\\' AND id != ?3
+                ORDER BY username COLLATE NOCASE
+                LIMIT ?4
+            ''', ('%' + escaped + '%', escaped + '%', exclude_id, limit - len(users)))
+            users += cursor.fetchall()
+        return users
+    else:
+        cursor.execute('''
+            SELECT u.id, u.username, u.profile_image_url
+            FROM user_search s
+            JOIN users u ON u.id = s.rowid
+            WHERE user_search MATCH ? AND u.id != ?
+            ORDER BY instr(lower(u.username), lower(?)) = 1 DESC, bm25(user_search, 10.0, 1.0)
+            LIMIT ?
+        ''', ('"' + query.replace('"', '""') + '"', exclude_id, query, limit))
+    return cursor.fetchall()
+
 @mutuals_bp.route('/search')
 def search():
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
     user_id = session.get('user_id')
-    if not user_id:
+    if not user_id or not query:
         return jsonify([])
 
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute('''
-        SELECT u.id, u.username, u.profile_image_url
-        FROM users u
-        WHERE u.username LIKE ? AND u.id != ?
-        LIMIT 10
-    ''', (f'%{query}%', user_id))
-
-    users = cursor.fetchall()
+    users = search_users(query, user_id)
     return jsonify([{
         'id': user['id'],
         'username': user['username'],
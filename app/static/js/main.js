@@ -79,6 +79,12 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Initialize selected hashtags from user data
     initializeSelectedHashtags();
+
+    // Poll background processing of an uploaded activity log
+    const ingestStatus = document.getElementById('ingest-status');
+    if (ingestStatus) {
+        pollIngestJob(ingestStatus.dataset.ingestJobId);
+    }
 });
 
 function showTab(tabName) {
@@ -408,6 +414,44 @@ window.onclick = function(event) {
     }
 }
 
+// Give up on a processing upload after this many status checks (about half
+// an hour at one check every 2 seconds, matching INGEST_JOB_TIMEOUT)
+const MAX_INGEST_POLLS = 900;
+
+function pollIngestJob(jobId, attempt = 1) {
+    const retry = delay => {
+        if (attempt >= MAX_INGEST_POLLS) {
+            stopIngestPolling('Your activity logs are taking too long to process. Please refresh the page later.');
+            return;
+        }
+        setTimeout(() => pollIngestJob(jobId, attempt + 1), delay);
+    };
+
+    fetch(`/api/jobs/${jobId}`)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'done') {
+                window.location.reload();
+            } else if (job.status === 'failed') {
+                stopIngestPolling(job.message || 'Error processing activity logs');
+            } else if (job.status) {
+                retry(2000);
+            }
+        })
+        .catch(error => {
+            console.error('Error checking upload status:', error);
+            retry(5000);
+        });
+}
+
+function stopIngestPolling(message) {
+    const status = document.getElementById('ingest-status');
+    if (status) {
+        status.remove();
+    }
+    showAlert(message, 'error');
+}
+
 function closeUploadModal() {
     const modal = document.getElementById('upload-modal');
     if (modal) {
@@ -436,28 +480,7 @@ function showFollowersModal() {
     const list = document.getElementById('followers-list');
 
     if (modal && list) {
-        // Clear previous content
-        list.innerHTML = '<div class="loading">Loading...</div>';
-
-        // Fetch followers data
-        fetch('/api/followers/' + getCurrentUserId())
-            .then(response => response.json())
-            .then(data => {
-                list.innerHTML = '';
-                if (data.length === 0) {
-                    list.innerHTML = '<p>No followers yet.</p>';
-                } else {
-                    data.forEach(user => {
-                        const userItem = createUserListItem(user);
-                        list.appendChild(userItem);
-                    });
-                }
-            })
-            .catch(error => {
-                console.error('Error loading followers:', error);
-                list.innerHTML = '<p>Error loading followers.</p>';
-            });
-
+        loadListPages('/api/followers/' + getCurrentUserId(), list, 'No followers yet.', 'Error loading followers.');
         modal.style.display = 'block';
     }
 }
@@ -467,30 +490,66 @@ function showFollowingModal() {
     const list = document.getElementById('following-list');
 
     if (modal && list) {
-        // Clear previous content
-        list.innerHTML = '<div class="loading">Loading...</div>';
-
-        // Fetch following data
-        fetch('/api/following/' + getCurrentUserId())
-            .then(response => response.json())
-            .then(data => {
-                list.innerHTML = '';
-                if (data.length === 0) {
-                    list.innerHTML = '<p>Not following anyone yet.</p>';
-                } else {
-                    data.forEach(user => {
-                        const userItem = createUserListItem(user);
-                        list.appendChild(userItem);
-                    });
+        loadListPages('/api/following/' + getCurrentUserId(), list, 'Not following anyone yet.', 'Error loading following.');
+        modal.style.display = 'block';
+    }
+}
+
+// Fill a modal list from a keyset-paginated list API. The next page (from
+// the X-Next-Cursor header) is fetched when the end of the list scrolls
+// into view, until the API stops returning a cursor.
+function loadListPages(url, list, emptyMessage, errorMessage) {
+    list.pageObserver?.disconnect();
+    list.innerHTML = '<div class="loading">Loading...</div>';
+
+    // Pages of a list that was reopened for another URL are dropped
+    const generation = (list.pageGeneration || 0) + 1;
+    list.pageGeneration = generation;
+
+    const sentinel = document.createElement('div');
+    sentinel.className = 'list-sentinel';
+    let nextCursor = null;
+    let loading = false;
+
+    function loadPage(cursor) {
+        loading = true;
+        const pageUrl = cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url;
+        fetch(pageUrl)
+            .then(response => response.json().then(data => [data, response.headers.get('X-Next-Cursor')]))
+            .then(([data, next]) => {
+                if (list.pageGeneration !== generation) {
+                    return;
+                }
+                if (!cursor) {
+                    list.innerHTML = '';
+                    if (data.length === 0) {
+                        list.innerHTML = `<p>${emptyMessage}</p>`;
+                        return;
+                    }
+                }
+                sentinel.remove();
+                data.forEach(user => list.appendChild(createUserListItem(user)));
+                nextCursor = next;
+                loading = false;
+                if (nextCursor) {
+                    list.appendChild(sentinel);
                 }
             })
             .catch(error => {
-                console.error('Error loading following:', error);
-                list.innerHTML = '<p>Error loading following.</p>';
+                console.error(errorMessage, error);
+                if (list.pageGeneration === generation) {
+                    list.innerHTML = `<p>${errorMessage}</p>`;
+                }
             });
-
-        modal.style.display = 'block';
     }
+
+    list.pageObserver = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting) && nextCursor && !loading) {
+            loadPage(nextCursor);
+        }
+    });
+    list.pageObserver.observe(sentinel);
+    loadPage(null);
 }
 
 function closeFollowersModal() {
@@ -571,36 +630,8 @@ function showTrendUsersModal(trendType, trendName) {
     const list = document.getElementById('trend-users-list');
 
     if (modal && list) {
-        // Clear previous content
-        list.innerHTML = '<div class="loading">Loading...</div>';
-
-        // Fetch trend users data
-        fetch(`/api/trend_users/${trendType}/${encodeURIComponent(trendName)}`)
-            .then(response => response.json())
-            .then(data => {
-                list.innerHTML = '';
-                if (data.length === 0) {
-                    list.innerHTML = '<p>No users found.</p>';
-                } else {
-                    data.forEach(user => {
-                        const userItem = document.createElement('div');
-                        userItem.className = 'user-list-item';
-                        userItem.innerHTML = `
-                            <img src="${user.profile_image_url}" alt="${user.username}" class="user-list-avatar">
-                            <div class="user-list-info">
-                                <h4><a href="/user/${user.id}" style="text-decoration: none; color: inherit;">${user.username}</a></h4>
-                                <p>Click to view profile</p>
-                            </div>
-                        `;
-                        list.appendChild(userItem);
-                    });
-                }
-            })
-            .catch(error => {
-                console.error('Error loading trend users:', error);
-                list.innerHTML = '<p>Error loading users.</p>';
-            });
-
+        loadListPages(`/api/trend_users/${trendType}/${encodeURIComponent(trendName)}`, list,
+                      'No users found.', 'Error loading users.');
         modal.style.display = 'block';
     }
 }
@@ -618,36 +649,8 @@ function showTrendFollowersModal(trendType, trendName) {
     const list = document.getElementById('trend-followers-list');
 
     if (modal && list) {
-        // Clear previous content
-        list.innerHTML = '<div class="loading">Loading...</div>';
-
-        // Fetch trend followers data
-        fetch(`/api/trend_followers/${trendType}/${encodeURIComponent(trendName)}`)
-            .then(response => response.json())
-            .then(data => {
-                list.innerHTML = '';
-                if (data.length === 0) {
-                    list.innerHTML = '<p>No followers found.</p>';
-                } else {
-                    data.forEach(user => {
-                        const userItem = document.createElement('div');
-                        userItem.className = 'user-list-item';
-                        userItem.innerHTML = `
-                            <img src="${user.profile_image_url}" alt="${user.username}" class="user-list-avatar">
-                            <div class="user-list-info">
-                                <h4><a href="/user/${user.id}" style="text-decoration: none; color: inherit;">${user.username}</a></h4>
-                                <p>Click to view profile</p>
-                            </div>
-                        `;
-                        list.appendChild(userItem);
-                    });
-                }
-            })
-            .catch(error => {
-                console.error('Error loading trend followers:', error);
-                list.innerHTML = '<p>Error loading followers.</p>';
-            });
-
+        loadListPages(`/api/trend_followers/${trendType}/${encodeURIComponent(trendName)}`, list,
+                      'No followers found.', 'Error loading followers.');
         modal.style.display = 'block';
     }
 }
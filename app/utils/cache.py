@@ -0,0 +1,149 @@
+"""Per-process caches kept consistent across processes by version rows.
+
+Every cached value is stored with the cache_versions counter it was computed
+at. The counter is bumped whenever the underlying table changes (by
+triggers, or once per write for 'trends'), so any worker process sees the
+new version on its next read and recomputes, while the TTL bounds how long
+an entry lives at all.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, make_response, request, session
+from app.utils.db import get_db
+
+# Listing parameters that get cached; anything else is queried directly
+TREND_SORTS = {
+    'popular': 'count DESC',
+    'recent': 'last_updated DESC',
+    'alphabetical': 'name ASC',
+}
+TREND_FILTERS = ('all', 'hashtag', 'music', 'creator', 'topic')
+
+# "Trending now": each trend's net count change over the sliding window,
+# with every hourly/daily bucket weighted by trend_decay of its age
+TRENDING_QUERY = '''
+    WITH buckets AS (
+        SELECT hour_start as start, trend_type, name, delta FROM trend_hourly WHERE hour_start >= :since
+        UNION ALL
+        SELECT day_start, trend_type, name, delta FROM trend_daily WHERE day_start >= :since
+    ),
+    scores AS (
+        SELECT trend_type, name, SUM(delta * trend_decay(:now - start, :half_life)) as score
+        FROM buckets
+        GROUP BY trend_type, name
+    )
+    SELECT gt.*, s.score
+    FROM scores s
+    JOIN global_trends gt ON gt.trend_type = s.trend_type AND gt.name = s.name
+    WHERE s.score > 0 {where}
+    ORDER BY s.score DESC, gt.count DESC
+    LIMIT 20
+'''
+
+
+class VersionedCache:
+    """Thread-safe map of key -> value that expires by TTL or version change.
+
+    With max_entries set, the least recently used entry is dropped once the
+    cache is full.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, ttl, compute):
+        """Return the cached value for key, calling compute() if it is missing, stale or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        if entry and entry[0] == version and entry[1] > now:
+            return entry[2]
+        value = compute()
+        with self._lock:
+            self._entries[key] = (version, now + ttl, value)
+            self._entries.move_to_end(key)
+            if self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_trend_listings = VersionedCache()
+
+
+def cache_version(name):
+    """Current value of a cache_versions counter."""
+    row = get_db().execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    return row['version'] if row else 0
+
+
+def bump_cache_version(cursor, name):
+    """Move a cache_versions counter on, inside the write that changed its data."""
+    cursor.execute('''
+        INSERT INTO cache_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+    ''', (name,))
+
+
+def trend_listing(sort_by, filter_by, version):
+    """Top 20 global trends for a home/For You listing, cached per (sort, filter).
+
+    version is the current 'trends' cache version; the caller already read it
+    for the ETag. Rows come back as dicts so they can be shared across threads.
+    'trending' scores also decay with time, which the TTL bounds.
+    """
+    config = current_app.config
+
+    def query():
+        cursor = get_db().cursor()
+        if sort_by == 'trending':
+            now = time.time()
+            cursor.execute(TRENDING_QUERY.format(where='' if filter_by == 'all' else 'AND gt.trend_type = :filter'), {
+                'now': now,
+                'since': now - config['TRENDING_WINDOW_HOURS'] * 3600,
+                'half_life': config['TRENDING_HALF_LIFE_HOURS'] * 3600,
+                'filter': filter_by,
+            })
+            return [dict(row) for row in cursor.fetchall()]
+
+        where = '' if filter_by == 'all' else 'WHERE trend_type = ?'
+        params = () if filter_by == 'all' else (filter_by,)
+        cursor.execute(f'''
+            SELECT * FROM global_trends {where}
+            ORDER BY {TREND_SORTS.get(sort_by, TREND_SORTS['popular'])}
+            LIMIT 20
+        ''', params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    if filter_by not in TREND_FILTERS:
+        return query()
+    sort_by = sort_by if sort_by in TREND_SORTS or sort_by == 'trending' else 'popular'
+    return _trend_listings.get((sort_by, filter_by), version, config['TRENDS_CACHE_TTL'], query)
+
+
+def conditional_page(render, *etag_parts):
+    """Serve a per-user page with an ETag built from etag_parts, or a 304.
+
+    The logged-in user is part of the ETag since pages show their session.
+    render() is only called when the browser's copy is out of date. Pages
+    with pending flash messages are always rendered so the flashes show.
+    """
+    parts = (session.get('user_id'), session.get('username')) + etag_parts
+    etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
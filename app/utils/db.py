@@ -1,134 +1,537 @@
+import os
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from flask import g, current_app
 import json
 from datetime import datetime
 import time
 
+# user_interests JSON columns and the kind their items get in user_interest_items
+INTEREST_COLUMNS = (
+    ('hashtags', 'hashtag'),
+    ('music_liked', 'music'),
+    ('trends_followed', 'trend'),
+    ('celebrities_followed', 'creator'),
+)
+
+# user_stats counters: (follow table, user column counted, user_stats column)
+FOLLOW_COUNTERS = (
+    ('follows', 'following_id', 'followers'),
+    ('follows', 'follower_id', 'following'),
+    ('hashtag_follows', 'user_id', 'hashtag_following'),
+    ('music_follows', 'user_id', 'music_following'),
+    ('creator_follows', 'user_id', 'creator_following'),
+)
+
+# trend_stats follower counts: (follow table, trend name column, trend_type,
+# prefix that turns the followed name into the global_trends name)
+TREND_FOLLOWS = (
+    ('hashtag_follows', 'hashtag_name', 'hashtag', '#'),
+    ('music_follows', 'song_name', 'music', ''),
+    ('creator_follows', 'creator_name', 'creator', '@'),
+)
+
+# Callback given every SQL statement run on connections opened from now on
+_statement_trace = None
+
+def set_statement_trace(callback):
+    """Trace the statements of connections opened after this call (None to stop)."""
+    global _statement_trace
+    _statement_trace = callback
+
+def trend_decay(age, half_life):
+    """Weight of a trend bucket `age` seconds old, halving every `half_life` seconds."""
+    return 0.5 ** (max(age, 0) / half_life)
+
+def connect(db_path, cached_statements=256, read_only=False, mmap_size=0):
+    """Open a connection with the app's PRAGMAs and SQL functions applied."""
+    db = sqlite3.connect(
+        db_path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=30.0,  # 30 second busy timeout
+        isolation_level=None,  # Enable autocommit mode
+        check_same_thread=False,  # Handed between threads by the pool
+        cached_statements=cached_statements
+    )
+    db.row_factory = sqlite3.Row
+    # Enable WAL mode for better concurrency
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('PRAGMA cache_size=1000')
+    db.execute('PRAGMA temp_store=memory')
+    if mmap_size:
+        db.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    if read_only:
+        db.execute('PRAGMA query_only=ON')
+    db.create_function('trend_decay', 2, trend_decay, deterministic=True)
+    if _statement_trace is not None:
+        db.set_trace_callback(_statement_trace)
+    return db
+
+class ConnectionPool:
+    """Thread-safe pool of read-only SQLite connections to one database file.
+
+    Connections are opened lazily up to `size`, get their PRAGMAs once when
+    opened, and keep sqlite3's per-connection prepared statement cache warm
+    between requests. Writes go through the process's DatabaseWriter. A pool
+    belongs to the process that created it; forked workers build their own
+    through get_pool().
+    """
+
+    def __init__(self, db_path, size=8, timeout=30.0, cached_statements=256, mmap_size=0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.mmap_size = mmap_size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired = 0
+        self._waited = 0
+        self._wait_seconds = 0.0
+        self._discarded = 0
+
+    def acquire(self):
+        """Take an idle connection, opening one if the pool isn't full yet."""
+        waited = False
+        start = time.perf_counter()
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = None
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    opening = True
+                else:
+                    opening = False
+            if opening:
+                try:
+                    db = connect(self.db_path, self.cached_statements, read_only=True, mmap_size=self.mmap_size)
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    db = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError(f'No database connection free after {self.timeout}s (pool size {self.size})')
+
+        with self._lock:
+            self._acquired += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            if waited:
+                self._waited += 1
+                self._wait_seconds += time.perf_counter() - start
+        return db
+
+    def release(self, db):
+        """Return a connection, rolling back anything left uncommitted."""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+        except sqlite3.Error:
+            # Broken connection: drop it so a fresh one is opened instead
+            with self._lock:
+                self._opened -= 1
+                self._discarded += 1
+            db.close()
+            return
+        self._idle.put(db)
+
+    def stats(self):
+        """Usage counters for monitoring."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'peak_in_use': self._peak_in_use,
+                'acquired': self._acquired,
+                'waited': self._waited,
+                'wait_seconds': round(self._wait_seconds, 3),
+                'discarded': self._discarded,
+            }
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._opened -= 1
+
+# Pools by (process id, database path)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool():
+    """Return this process's connection pool for the current app's database."""
+    config = current_app.config
+    db_path = config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+    key = (os.getpid(), db_path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    db_path,
+                    size=config['DB_POOL_SIZE'],
+                    timeout=config['DB_POOL_TIMEOUT'],
+                    cached_statements=config['DB_STATEMENT_CACHE'],
+                    mmap_size=config['DB_MMAP_SIZE']
+                )
+    return pool
+
+class DatabaseWriter:
+    """Thread owning a process's only writable SQLite connection.
+
+    Writes are functions taking a cursor. The thread takes whatever writes
+    are queued, up to batch_size, and commits them as one group transaction,
+    each inside its own savepoint so a failing write is rolled back and
+    reported to its caller without affecting the rest of the batch. Callers
+    are woken only once their write is committed.
+    """
+
+    def __init__(self, db_path, batch_size=64, cached_statements=256):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.cached_statements = cached_statements
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Opened here rather than in the thread, so a connection error reaches
+        # the caller instead of killing the thread with writes still queued
+        self._db = connect(db_path, cached_statements)
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+        self._largest_batch = 0
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(cursor, *args) and return a Future for its result."""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # A write issued from inside another write joins its transaction
+            try:
+                future.set_result(fn(self._db.cursor(), *args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((future, fn, args))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                # Keep the thread alive; fail whatever the batch left unresolved
+                if self._db.in_transaction:
+                    self._db.execute('ROLLBACK')
+                for future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit_batch(self, batch):
+        db = self._db
+        cursor = db.cursor()
+        done = []  # (future, result) of the writes in the open transaction
+        failed = 0
+
+        try:
+            db.execute('BEGIN IMMEDIATE')
+        except Exception as e:
+            for future, _, _ in batch:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            self._record(len(batch), len(batch))
+            return
+
+        for future, fn, args in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            db.execute('SAVEPOINT write')
+            try:
+                result = fn(cursor, *args)
+            except Exception as e:
+                failed += 1
+                if db.in_transaction:
+                    db.execute('ROLLBACK TO write')
+                    db.execute('RELEASE write')
+                else:
+                    # The error aborted the whole transaction, earlier writes included
+                    failed += len(done)
+                    for earlier, _ in done:
+                        earlier.set_exception(e)
+                    done = []
+                    db.execute('BEGIN IMMEDIATE')
+                future.set_exception(e)
+            else:
+                db.execute('RELEASE write')
+                done.append((future, result))
+
+        try:
+            db.execute('COMMIT')
+        except Exception as e:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            for future, _ in done:
+                future.set_exception(e)
+            self._record(len(batch), failed + len(done))
+            return
+
+        for future, result in done:
+            future.set_result(result)
+        self._record(len(batch), failed)
+
+    def _record(self, size, failed):
+        with self._lock:
+            self._batches += 1
+            self._writes += size
+            self._failed += failed
+            self._largest_batch = max(self._largest_batch, size)
+
+    def stats(self):
+        """Usage counters for monitoring."""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'writes': self._writes,
+                'failed': self._failed,
+                'largest_batch': self._largest_batch,
+                'avg_batch': round(self._writes / self._batches, 2) if self._batches else 0,
+            }
+
+# Writers by (process id, database path)
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer():
+    """Return this process's writer thread for the current app's database."""
+    config = current_app.config
+    db_path = config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+    key = (os.getpid(), db_path)
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = DatabaseWriter(
+                    db_path,
+                    batch_size=config['DB_WRITE_BATCH_SIZE'],
+                    cached_statements=config['DB_STATEMENT_CACHE']
+                )
+    return writer
+
+def run_write(fn, *args):
+    """Run fn(cursor, *args) on the writer thread and return its result once committed.
+
+    Exceptions raised by fn (e.g. sqlite3.IntegrityError) are re-raised here.
+    """
+    return get_writer().submit(fn, *args).result()
+
+def execute_write(sql, params=()):
+    """Run a single write statement on the writer thread and return its lastrowid."""
+    return run_write(lambda cursor: cursor.execute(sql, params).lastrowid)
+
 def get_db():
     if 'db' not in g:
-        db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        # Add timeout and isolation level for better concurrency
-        g.db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES,
-            timeout=30.0,  # 30 second timeout
-            isolation_level=None  # Enable autocommit mode
-        )
-        g.db.row_factory = sqlite3.Row
-        # Enable WAL mode for better concurrency
-        g.db.execute('PRAGMA journal_mode=WAL')
-        g.db.execute('PRAGMA synchronous=NORMAL')
-        g.db.execute('PRAGMA cache_size=1000')
-        g.db.execute('PRAGMA temp_store=memory')
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        g.pop('db_pool').release(db)
+
+@contextmanager
+def transaction(db, mode='IMMEDIATE'):
+    """Run a block of writes as one explicit transaction.
+
+    Connections from connect() are in autocommit mode, so without this every
+    statement is its own transaction. Writes from the app should go through
+    run_write() instead, which already wraps them in a transaction.
+    IMMEDIATE takes the write lock up front instead of failing half-way
+    through; nested uses join the outer transaction.
+    """
+    if db.in_transaction:
+        yield db
+        return
+    db.execute(f'BEGIN {mode}')
+    try:
+        yield db
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
 
 def init_db(app):
+    # Return each request's connection to the pool when its app context ends
+    app.teardown_appcontext(close_db)
+
     with app.app_context():
-        db = get_db()
+        # Schema changes and backfills use their own writable connection,
+        # since request connections are read-only
+        db = connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
         cursor = db.cursor()
 
-        # Create Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                profile_image_url TEXT,
-                bio TEXT,
-                profile_hashtags TEXT
-            )
-        ''')
-
-        # Create ActivityLogs table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                zip_filename TEXT NOT NULL,
-                processed BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-
-        # Create UserInterests table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_interests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                hashtags TEXT,  -- JSON array
-                music_liked TEXT,  -- JSON array
-                trends_followed TEXT,  -- JSON array
-                celebrities_followed TEXT,  -- JSON array
-                posts_liked_count INTEGER DEFAULT 0,
-                reels_watched_count INTEGER DEFAULT 0,
-                comments_made_count INTEGER DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-
-        # Create GlobalTrends table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS global_trends (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                trend_type TEXT NOT NULL,  -- hashtag/music/creator/topic
-                name TEXT NOT NULL,
-                count INTEGER DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(trend_type, name)
-            )
-        ''')
-
-        # Create Follows table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS follows (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                follower_id INTEGER NOT NULL,
-                following_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (follower_id) REFERENCES users (id),
-                FOREIGN KEY (following_id) REFERENCES users (id),
-                UNIQUE(follower_id, following_id)
-            )
-        ''')
-
-        # Create HashtagFollows table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS hashtag_follows (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                hashtag_name TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(user_id, hashtag_name)
-            )
-        ''')
-
-        # Create MusicFollows table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS music_follows (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                song_name TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(user_id, song_name)
-            )
-        ''')
-
-        db.commit()
+        # Bring the schema up to the latest migration
+        from app.utils.migrations import run_migrations
+        run_migrations(db)
 
         # Seed sample users
         seed_sample_users(cursor)
         db.commit()
 
+        # Bring derived tables up to date with user_interests rows written before they existed
+        backfill_interest_tables(cursor)
+        db.commit()
+
+        backfill_user_stats(cursor)
+        db.commit()
+
+        backfill_trend_stats(cursor)
+        db.commit()
+
+        from app.utils.minhash import backfill_minhash
+        backfill_minhash(cursor, app.config.get('MINHASH_PERMUTATIONS', 64), app.config.get('LSH_BANDS', 16))
+        db.commit()
+
+        from app.utils.related import backfill_item_related
+        backfill_item_related(cursor, app.config.get('RELATED_TOP_N', 20))
+        db.commit()
+
+        from app.utils.matching import backfill_user_matches
+        backfill_user_matches(cursor, app.config.get('MATCHES_TOP_N', 50))
+        db.commit()
+
+        # Jobs whose process was restarted before they finished never will
+        from app.utils.jobs import fail_stale_jobs
+        fail_stale_jobs(cursor, app.config.get('INGEST_JOB_TIMEOUT', 30 * 60))
+        db.commit()
+        db.close()
+
+def backfill_interest_tables(cursor):
+    """Populate trend_contributions and user_interest_items from user_interests JSON columns."""
+    # Record contributions of users who uploaded before the ledger existed,
+    # with hashtags named like update_global_trends names them ('#' + the tag)
+    cursor.execute('''
+        INSERT OR IGNORE INTO trend_contributions (user_id, trend_type, name)
+        SELECT ui.user_id, 'hashtag', '#' || ltrim(j.value, '#') FROM user_interests ui, json_each(ui.hashtags) j
+        WHERE json_valid(ui.hashtags) AND ui.user_id NOT IN (SELECT user_id FROM trend_contributions)
+        UNION ALL
+        SELECT ui.user_id, 'music', j.value FROM user_interests ui, json_each(ui.music_liked) j
+        WHERE json_valid(ui.music_liked) AND ui.user_id NOT IN (SELECT user_id FROM trend_contributions)
+        UNION ALL
+        SELECT ui.user_id, 'creator', j.value FROM user_interests ui, json_each(ui.celebrities_followed) j
+        WHERE json_valid(ui.celebrities_followed) AND ui.user_id NOT IN (SELECT user_id FROM trend_contributions)
+    ''')
+
+    # Normalize interests of users that have no user_interest_items rows yet
+    cursor.execute('''
+        CREATE TEMP TABLE backfill_users AS
+        SELECT user_id FROM user_interests
+        WHERE user_id NOT IN (SELECT user_id FROM user_interest_items)
+    ''')
+    for column, kind in INTEREST_COLUMNS:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO interest_items (kind, name)
+            SELECT DISTINCT ?, j.value
+            FROM user_interests ui, json_each(ui.{column}) j
+            WHERE json_valid(ui.{column}) AND ui.user_id IN (SELECT user_id FROM backfill_users)
+        ''', (kind,))
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO user_interest_items (user_id, kind, item_id)
+            SELECT ui.user_id, ii.kind, ii.id
+            FROM user_interests ui, json_each(ui.{column}) j
+            JOIN interest_items ii ON ii.kind = ? AND ii.name = j.value
+            WHERE json_valid(ui.{column}) AND ui.user_id IN (SELECT user_id FROM backfill_users)
+        ''', (kind,))
+    cursor.execute('DROP TABLE backfill_users')
+
+def backfill_user_stats(cursor):
+    """Create user_stats rows, counted from the follow tables, for users that have none."""
+    counts = ',\n'.join(
+        f'(SELECT COUNT(*) FROM {table} WHERE {user_column} = u.id)'
+        for table, user_column, _ in FOLLOW_COUNTERS
+    )
+    cursor.execute(f'''
+        INSERT INTO user_stats (user_id, {', '.join(counter for _, _, counter in FOLLOW_COUNTERS)})
+        SELECT u.id, {counts}
+        FROM users u
+        WHERE u.id NOT IN (SELECT user_id FROM user_stats)
+    ''')
+
+def backfill_trend_stats(cursor):
+    """Reconcile trend_stats with global_trends.
+
+    Adds rows for trends written outside update_global_trends (the sample
+    trends are re-seeded on every start), drops rows for trends that are
+    gone and copies changed counts.
+    """
+    from app.utils.helpers import normalize_tag
+
+    cursor.execute('''
+        DELETE FROM trend_stats WHERE NOT EXISTS (
+            SELECT 1 FROM global_trends gt WHERE gt.trend_type = trend_stats.trend_type AND gt.name = trend_stats.name
+        )
+    ''')
+    cursor.execute('''
+        SELECT gt.trend_type, gt.name FROM global_trends gt
+        WHERE NOT EXISTS (SELECT 1 FROM trend_stats ts WHERE ts.trend_type = gt.trend_type AND ts.name = gt.name)
+    ''')
+    cursor.executemany(
+        'INSERT INTO trend_stats (trend_type, name, tag) VALUES (?, ?, ?)',
+        [(trend_type, name, normalize_tag(name)) for trend_type, name in cursor.fetchall()]
+    )
+    for table, column, trend_type, prefix in TREND_FOLLOWS:
+        cursor.execute(f'''
+            UPDATE trend_stats SET followers = (
+                SELECT COUNT(*) FROM {table} WHERE {column} = substr(trend_stats.name, ?)
+            )
+            WHERE trend_type = ? AND name LIKE ? || '%'
+        ''', (len(prefix) + 1, trend_type, prefix))
+    cursor.execute('''
+        UPDATE trend_stats SET
+            count = gt.count,
+            profile_users = (SELECT COUNT(*) FROM profile_tags WHERE tag = trend_stats.tag)
+        FROM global_trends gt
+        WHERE gt.trend_type = trend_stats.trend_type AND gt.name = trend_stats.name
+    ''')
+
 def seed_sample_users(cursor):
     sample_users = [
         ('alex_johnson', 'alex@example.com', 'hashedpass1', None),
@@ -187,3 +590,6 @@ def seed_sample_users(cursor):
             'INSERT OR REPLACE INTO global_trends (trend_type, name, count) VALUES (?, ?, ?)',
             (trend_type, name, count)
         )
+
+    from app.utils.cache import bump_cache_version
+    bump_cache_version(cursor, 'trends')
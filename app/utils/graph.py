@@ -0,0 +1,187 @@
+"""In-memory follow graph in compressed sparse row (CSR) form.
+
+Each process keeps the whole follows table as two arrays: offsets, indexed
+by user id, and targets, holding every user's followed ids sorted, so
+following(u) is targets[offsets[u]:offsets[u + 1]] and is_following is a
+binary search in that slice. The graph is loaded at the 'follows' cache
+version, which triggers bump on every follows insert and delete. Follows
+and unfollows made through this process are applied to a small overlay
+when the version moved by exactly that change; any other move means
+another process (or an account deletion) changed follows, and the graph is
+reloaded on next use.
+
+A FollowGraph is never changed once built. Applying a follow makes a new
+graph sharing the arrays with a copied overlay, swapped in under the lock,
+so a request holding a graph reads one consistent snapshot while others
+follow and unfollow.
+
+With several server processes, each has its own graph and only sees its
+own follows as deltas: every follow made through another process costs
+this one a full reload, O(follows). That is cheap while follows are rare
+next to reads; if they aren't, the way forward is a change log of follows
+each process replays from its version instead of reloading.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import islice
+from app.utils.db import get_db
+from app.utils.cache import cache_version
+
+
+def build_csr(edges):
+    """(offsets, targets) arrays for (follower_id, following_id) pairs sorted by follower, then following."""
+    edges = list(edges)
+    size = max((max(a, b) for a, b in edges), default=0) + 2
+    offsets = array('q', bytes(8 * size))
+    targets = array('q', (b for _, b in edges))
+    for a, _ in edges:
+        offsets[a + 1] += 1
+    for i in range(1, size):
+        offsets[i] += offsets[i - 1]
+    return offsets, targets
+
+
+class FollowGraph:
+    """An immutable snapshot of the follow edges: CSR arrays plus an overlay of edges changed since they were built."""
+
+    def __init__(self, csr, version, added=None, removed=None, changes=0):
+        """csr: (offsets, targets) from build_csr; added/removed: {follower_id: frozenset of ids}."""
+        self.version = version
+        self._csr = csr
+        self._added = added or {}
+        self._removed = removed or {}
+        self._changes = changes
+
+    def _bounds(self, user_id):
+        """(targets, start, stop) of user_id's row, without copying it."""
+        offsets, targets = self._csr
+        if user_id + 1 >= len(offsets):
+            return targets, 0, 0
+        return targets, offsets[user_id], offsets[user_id + 1]
+
+    def _row(self, user_id):
+        targets, start, stop = self._bounds(user_id)
+        return targets[start:stop]
+
+    def following(self, user_id):
+        """Ids user_id follows, sorted."""
+        row = self._row(user_id)
+        added, removed = self._added.get(user_id), self._removed.get(user_id)
+        if not added and not removed:
+            return row
+        return sorted((set(row) - (removed or set())) | (added or set()))
+
+    def _follows(self, bounds, added, removed, following_id):
+        if following_id in added:
+            return True
+        if following_id in removed:
+            return False
+        targets, start, stop = bounds
+        i = bisect_left(targets, following_id, start, stop)
+        return i < stop and targets[i] == following_id
+
+    def is_following(self, follower_id, following_id):
+        return self._follows(self._bounds(follower_id), self._added.get(follower_id, ()),
+                             self._removed.get(follower_id, ()), following_id)
+
+    def following_among(self, user_id, user_ids):
+        """The ids in user_ids that user_id follows."""
+        bounds = self._bounds(user_id)
+        added, removed = self._added.get(user_id, ()), self._removed.get(user_id, ())
+        return {other for other in user_ids if self._follows(bounds, added, removed, other)}
+
+    def followers_among(self, user_id, user_ids):
+        """The ids in user_ids that follow user_id."""
+        return {other for other in user_ids if self.is_following(other, user_id)}
+
+    def suggestions(self, user_id, limit=10, depth=2, max_fanout=200):
+        """Rank users to follow by the follow paths leading to them from user_id.
+
+        Walks up to depth hops out along follows. Users two hops away score
+        one per followed user who follows them; every hop further halves a
+        path's weight. Users user_id already follows, and user_id, are left
+        out. Each hop expands at most max_fanout of the best-connected
+        users, following at most max_fanout ids from each, which bounds the
+        walk regardless of graph size. Returns [(user_id, score)], best first.
+        """
+        followed = set(self.following(user_id))
+        scores = Counter()
+        frontier = {user_id: 1.0}
+        expanded = set()
+        for hop in range(1, depth + 1):
+            reached = Counter()
+            for node, paths in frontier.items():
+                expanded.add(node)
+                for other in islice(self.following(node), max_fanout):
+                    reached[other] += paths
+            if hop > 1:
+                for other, paths in reached.items():
+                    if other != user_id and other not in followed:
+                        scores[other] += paths / 2 ** (hop - 2)
+            frontier = dict(Counter({node: paths for node, paths in reached.items()
+                                     if node not in expanded}).most_common(max_fanout))
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def apply(self, follower_id, following_id, follows, version):
+        """A new graph at version with a follow (follows=True) or unfollow added to the overlay."""
+        added = set(self._added.get(follower_id, ()))
+        removed = set(self._removed.get(follower_id, ()))
+        if follows:
+            removed.discard(following_id)
+            added.add(following_id)
+        else:
+            added.discard(following_id)
+            removed.add(following_id)
+
+        # Fold a grown overlay back into new arrays
+        offsets, targets = self._csr
+        if self._changes + 1 > max(1024, len(targets) // 8):
+            users = set(range(len(offsets) - 1)) | self._added.keys() | {follower_id}
+            current = FollowGraph(self._csr, version, {**self._added, follower_id: added},
+                                  {**self._removed, follower_id: removed})
+            return FollowGraph(build_csr((a, b) for a in sorted(users) for b in current.following(a)), version)
+
+        return FollowGraph(self._csr, version,
+                           {**self._added, follower_id: frozenset(added)},
+                           {**self._removed, follower_id: frozenset(removed)},
+                           self._changes + 1)
+
+
+_graph = None
+_lock = threading.Lock()
+
+
+def load_follow_graph(db):
+    """Build a FollowGraph from the follows table at its current version."""
+    version = db.execute("SELECT version FROM cache_versions WHERE name = 'follows'").fetchone()
+    cursor = db.execute('SELECT follower_id, following_id FROM follows ORDER BY follower_id, following_id')
+    return FollowGraph(build_csr((row[0], row[1]) for row in cursor), version[0] if version else 0)
+
+
+def follow_graph():
+    """This process's current follow graph, reloaded if follows changed elsewhere.
+
+    The graph returned never changes, so a request should hold on to it
+    rather than call this again for every check.
+    """
+    global _graph
+    version = cache_version('follows')
+    with _lock:
+        if _graph is None or _graph.version != version:
+            _graph = load_follow_graph(get_db())
+        return _graph
+
+
+def record_follow(follower_id, following_id, follows, version):
+    """Apply a follow or unfollow written through this process to its graph.
+
+    version is the 'follows' cache version read in the same write. The
+    overlay only takes the change when it is the one change since the graph
+    was loaded; otherwise the graph is left stale for follow_graph to reload.
+    """
+    global _graph
+    with _lock:
+        if _graph is not None and version == _graph.version + 1:
+            _graph = _graph.apply(follower_id, following_id, follows, version)
@@ -1,10 +1,17 @@
 import re
 import json
-import zipfile
-import os
+import base64
+import hashlib
+import time
+from collections import Counter
 from flask import current_app
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.utils.db import get_db
+from app.utils.db import get_db, run_write, INTEREST_COLUMNS, TREND_FOLLOWS
+from app.utils.cache import bump_cache_version
+from app.utils.ingest import parse_export
+from app.utils.minhash import update_user_minhash
+from app.utils.matching import refresh_user_matches
+from app.utils.related import refresh_item_related
 
 def validate_required_fields(data, fields):
     """Validate that required fields are present and not empty."""
@@ -26,104 +33,184 @@ def validate_image_url(url):
     return re.match(pattern, url, re.IGNORECASE) is not None
 
 def calculate_interest_match(user1_id, user2_id):
-    """Calculate interest match percentage between two users."""
+    """Calculate interest match percentage between two users.
+
+    For every kind of interest the shared items count as matches out of the
+    larger of the two users' lists.
+    """
     db = get_db()
     cursor = db.cursor()
 
-    # Get interests for both users
-    cursor.execute('SELECT * FROM user_interests WHERE user_id = ?', (user1_id,))
-    user1 = cursor.fetchone()
-    cursor.execute('SELECT * FROM user_interests WHERE user_id = ?', (user2_id,))
-    user2 = cursor.fetchone()
-
-    if not user1 or not user2:
+    # Both users need to have uploaded activity logs
+    cursor.execute('SELECT COUNT(*) as count FROM user_interests WHERE user_id IN (?, ?)', (user1_id, user2_id))
+    if cursor.fetchone()['count'] < (1 if user1_id == user2_id else 2):
         return 0
 
-    total_matches = 0
-    total_possible = 0
-
-    # Compare hashtags
-    if user1['hashtags'] and user2['hashtags']:
-        h1 = set(json.loads(user1['hashtags']))
-        h2 = set(json.loads(user2['hashtags']))
-        total_matches += len(h1.intersection(h2))
-        total_possible += max(len(h1), len(h2))
-
-    # Compare music
-    if user1['music_liked'] and user2['music_liked']:
-        m1 = set(json.loads(user1['music_liked']))
-        m2 = set(json.loads(user2['music_liked']))
-        total_matches += len(m1.intersection(m2))
-        total_possible += max(len(m1), len(m2))
-
-    # Compare trends
-    if user1['trends_followed'] and user2['trends_followed']:
-        t1 = set(json.loads(user1['trends_followed']))
-        t2 = set(json.loads(user2['trends_followed']))
-        total_matches += len(t1.intersection(t2))
-        total_possible += max(len(t1), len(t2))
-
-    # Compare celebrities
-    if user1['celebrities_followed'] and user2['celebrities_followed']:
-        c1 = set(json.loads(user1['celebrities_followed']))
-        c2 = set(json.loads(user2['celebrities_followed']))
-        total_matches += len(c1.intersection(c2))
-        total_possible += max(len(c1), len(c2))
+    # Items each user has per kind
+    cursor.execute('''
+        SELECT kind, SUM(user_id = ?) as count1, SUM(user_id = ?) as count2
+        FROM user_interest_items
+        WHERE user_id IN (?, ?)
+        GROUP BY kind
+    ''', (user1_id, user2_id, user1_id, user2_id))
+    total_possible = sum(max(row['count1'], row['count2']) for row in cursor.fetchall())
+
+    # Items both users share
+    cursor.execute('''
+        SELECT COUNT(*) as count
+        FROM user_interest_items a
+        JOIN user_interest_items b ON b.user_id = ? AND b.kind = a.kind AND b.item_id = a.item_id
+        WHERE a.user_id = ?
+    ''', (user2_id, user1_id))
+    total_matches = cursor.fetchone()['count']
 
     return int((total_matches / total_possible * 100) if total_possible > 0 else 0)
 
-def process_zip_file(zip_path, user_id):
-    """Extract and parse Instagram activity log data from zip file."""
+def sync_interest_items(cursor, user_id, interests):
+    """Bring the user's user_interest_items rows in line with their interests.
+
+    Only the difference is written. Returns the (kind, name) pairs that
+    were added and removed.
+    """
+    current = {(kind, name) for column, kind in INTEREST_COLUMNS for name in interests[column]}
+
+    cursor.execute('''
+        SELECT ii.kind, ii.name
+        FROM user_interest_items uii
+        JOIN interest_items ii ON ii.id = uii.item_id
+        WHERE uii.user_id = ?
+    ''', (user_id,))
+    previous = {(row['kind'], row['name']) for row in cursor.fetchall()}
+
+    added = current - previous
+    removed = previous - current
+
+    cursor.executemany('INSERT OR IGNORE INTO interest_items (kind, name) VALUES (?, ?)', added)
+    cursor.executemany('''
+        INSERT INTO user_interest_items (user_id, kind, item_id)
+        SELECT ?, kind, id FROM interest_items WHERE kind = ? AND name = ?
+    ''', [(user_id, kind, name) for kind, name in added])
+    cursor.executemany('''
+        DELETE FROM user_interest_items
+        WHERE user_id = ? AND kind = ? AND item_id = (SELECT id FROM interest_items WHERE kind = ? AND name = ?)
+    ''', [(user_id, kind, kind, name) for kind, name in removed])
+
+    return added, removed
+
+def normalize_tag(name):
+    """Lowercase a hashtag, song or creator name and drop any leading # or @."""
+    return name.strip().lstrip('#@').strip().lower()
+
+def profile_tags(profile_hashtags):
+    """Split a comma-separated profile_hashtags value into its set of normalized tags."""
+    return {tag for tag in map(normalize_tag, (profile_hashtags or '').split(',')) if tag}
+
+def sync_profile_tags(cursor, user_id, profile_hashtags):
+    """Bring the user's profile_tags rows in line with their profile_hashtags.
+
+    Only the difference is written, like sync_interest_items.
+    """
+    current = profile_tags(profile_hashtags)
+    cursor.execute('SELECT tag FROM profile_tags WHERE user_id = ?', (user_id,))
+    previous = {row[0] for row in cursor.fetchall()}
+
+    cursor.executemany('INSERT INTO profile_tags (tag, user_id) VALUES (?, ?)',
+                       [(tag, user_id) for tag in current - previous])
+    cursor.executemany('DELETE FROM profile_tags WHERE tag = ? AND user_id = ?',
+                       [(tag, user_id) for tag in previous - current])
+
+def encode_cursor(*values):
+    """Encode the sort key of a page's last row as an opaque keyset pagination cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, size):
+    """Decode a cursor from encode_cursor, or return None if it isn't one with size values."""
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # Extract to temp directory
-            extract_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'temp_{user_id}')
-            os.makedirs(extract_path, exist_ok=True)
-            zip_ref.extractall(extract_path)
-
-            # Parse JSON files (assuming specific structure)
-            data = {}
-            for root, dirs, files in os.walk(extract_path):
-                for file in files:
-                    if file.endswith('.json'):
-                        with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
-                            try:
-                                file_data = json.load(f)
-                                data.update(file_data)
-                            except json.JSONDecodeError:
-                                continue
-
-            # Process the data
-            interests = {
-                'hashtags': [],
-                'music_liked': [],
-                'trends_followed': [],
-                'celebrities_followed': [],
-                'posts_liked_count': 0,
-                'reels_watched_count': 0,
-                'comments_made_count': 0
-            }
-
-            if 'likes' in data:
-                interests['posts_liked_count'] = len(data['likes'])
-
-            if 'comments' in data:
-                interests['comments_made_count'] = len(data['comments'])
-
-            if 'hashtags_used' in data:
-                # Strip # prefixes from hashtags to store them consistently
-                interests['hashtags'] = [tag.lstrip('#') for tag in data['hashtags_used']]
-
-            if 'music_liked' in data:
-                interests['music_liked'] = data['music_liked']
-
-            if 'accounts_followed' in data:
-                interests['celebrities_followed'] = data['accounts_followed']
-
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == size else None
+
+def get_interest_lists(user_ids):
+    """Load interests for several users at once.
+
+    Returns a dict mapping each user id to a dict of user_interests column
+    name -> list of item names.
+    """
+    user_ids = list(user_ids)
+    columns = {kind: column for column, kind in INTEREST_COLUMNS}
+    lists = {user_id: {column: [] for column in columns.values()} for user_id in user_ids}
+    if not user_ids:
+        return lists
+
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT uii.user_id, uii.kind, ii.name
+        FROM user_interest_items uii
+        JOIN interest_items ii ON ii.id = uii.item_id
+        WHERE uii.user_id IN ({','.join('?' * len(user_ids))})
+        ORDER BY ii.id
+    ''', user_ids)
+    for row in cursor.fetchall():
+        lists[row['user_id']][columns[row['kind']]].append(row['name'])
+    return lists
+
+def get_user_interests(user_id):
+    """Return the user's interest lists and activity counts, or None if they haven't uploaded."""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT * FROM user_interests WHERE user_id = ?', (user_id,))
+    interests_row = cursor.fetchone()
+    if not interests_row:
+        return None
+
+    interests = get_interest_lists([user_id])[user_id]
+    interests.update({
+        'posts_liked_count': interests_row['posts_liked_count'],
+        'reels_watched_count': interests_row['reels_watched_count'],
+        'comments_made_count': interests_row['comments_made_count']
+    })
+    return interests
+
+def get_follow_counts(user_id):
+    """Return (followers, following) for a user, where following counts users, hashtags, music and creators."""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT followers, following + hashtag_following + music_following + creator_following as following
+        FROM user_stats WHERE user_id = ?
+    ''', (user_id,))
+    stats = cursor.fetchone()
+    return (stats['followers'], stats['following']) if stats else (0, 0)
 
+def process_zip_file(zip_path, user_id):
+    """Parse Instagram activity log data straight out of the uploaded zip file.
+
+    JSON members are streamed from the archive rather than extracted to disk,
+    so memory use stays bounded by the largest single entry, not the export size.
+    Large multi-file exports are parsed member by member across a process pool.
+    """
+    try:
+        cursor = get_db().cursor()
+
+        # Members unchanged since the user's last upload reuse their cached results
+        cursor.execute('SELECT member_name, crc32, file_size, partial FROM export_members WHERE user_id = ?', (user_id,))
+        cached = {
+            row['member_name']: (row['crc32'], row['file_size'], json.loads(row['partial']))
+            for row in cursor.fetchall()
+        }
+
+        interests, members = parse_export(
+            zip_path,
+            workers=current_app.config['INGEST_PARSE_WORKERS'],
+            parallel_min_bytes=current_app.config['INGEST_PARALLEL_MIN_BYTES'],
+            cached=cached
+        )
+
+        config = current_app.config
+        num_perm, bands, top_n = config['MINHASH_PERMUTATIONS'], config['LSH_BANDS'], config['MATCHES_TOP_N']
+        related_n = config['RELATED_TOP_N']
+
+        # Save to database in a single write on the writer thread
+        def save(cursor):
             cursor.execute('''
                 INSERT OR REPLACE INTO user_interests
                 (user_id, hashtags, music_liked, trends_followed, celebrities_followed,
@@ -148,57 +235,180 @@ def process_zip_file(zip_path, user_id):
                     'UPDATE users SET profile_hashtags = ? WHERE id = ?',
                     (profile_hashtags_str, user_id)
                 )
+                sync_profile_tags(cursor, user_id, profile_hashtags_str)
+
+            # Keep the normalized per-item table in sync
+            added, removed = sync_interest_items(cursor, user_id, interests)
+
+            # Move the user to their new LSH buckets and refresh the match
+            # and related-item lists their items appear in if they changed
+            if added or removed:
+                update_user_minhash(cursor, user_id, num_perm, bands)
+                refresh_user_matches(cursor, user_id, top_n)
+                refresh_item_related(cursor, user_id, added, removed, related_n)
 
             # Update global trends
-            update_global_trends(interests)
+            update_global_trends(cursor, user_id, interests)
 
-            db.commit()
+            # Remember per-member results so the next upload only reparses what changed
+            cursor.executemany(
+                'DELETE FROM export_members WHERE user_id = ? AND member_name = ?',
+                [(user_id, name) for name in cached.keys() - members.keys()]
+            )
+            cursor.executemany(
+                'INSERT OR REPLACE INTO export_members (user_id, member_name, crc32, file_size, partial) VALUES (?, ?, ?, ?, ?)',
+                [(user_id, name, crc, size, json.dumps(partial))
+                 for name, (crc, size, partial) in members.items() if cached.get(name) is not members[name]]
+            )
 
-            # Clean up temp files
-            import shutil
-            shutil.rmtree(extract_path)
+        run_write(save)
 
-            return True, "Activity logs processed successfully"
+        return True, "Activity logs processed successfully"
 
     except Exception as e:
         return False, f"Error processing zip file: {str(e)}"
 
-def update_global_trends(interests):
-    """Update global trends table with new data."""
-    db = get_db()
-    cursor = db.cursor()
-
-    # Update hashtags
-    for hashtag in interests['hashtags']:
-        cursor.execute('''
-            INSERT INTO global_trends (trend_type, name, count)
-            VALUES ('hashtag', ?, 1)
-            ON CONFLICT(trend_type, name) DO UPDATE SET
-            count = count + 1,
-            last_updated = CURRENT_TIMESTAMP
-        ''', ('#' + hashtag,))
-
-    # Update music
-    for music in interests['music_liked']:
-        cursor.execute('''
-            INSERT INTO global_trends (trend_type, name, count)
-            VALUES ('music', ?, 1)
-            ON CONFLICT(trend_type, name) DO UPDATE SET
-            count = count + 1,
-            last_updated = CURRENT_TIMESTAMP
-        ''', (music,))
-
-    # Update celebrities
-    for celeb in interests['celebrities_followed']:
-        cursor.execute('''
-            INSERT INTO global_trends (trend_type, name, count)
-            VALUES ('creator', ?, 1)
-            ON CONFLICT(trend_type, name) DO UPDATE SET
-            count = count + 1,
-            last_updated = CURRENT_TIMESTAMP
-        ''', (celeb,))
-
-    db.commit()
+# Interest lists that feed global_trends: (interests key, trend_type, name prefix)
+TREND_SOURCES = (
+    ('hashtags', 'hashtag', '#'),
+    ('music_liked', 'music', ''),
+    ('celebrities_followed', 'creator', ''),
+)
+
+# How long hourly trend buckets are kept before being rolled into daily ones,
+# and how long daily buckets are kept at all (seconds)
+TREND_HOURLY_RETENTION = 48 * 3600
+TREND_DAILY_RETENTION = 30 * 86400
+
+def collect_trends(interests):
+    """Return the set of (trend_type, name) keys a user's interests contribute."""
+    keys = set()
+    for key, trend_type, prefix in TREND_SOURCES:
+        keys.update((trend_type, prefix + name) for name in interests[key])
+    return keys
+
+def update_global_trends(cursor, user_id, interests):
+    """Update global trends table with new data.
+
+    Each user counts once towards a trend. What they contributed last time
+    is kept in trend_contributions, so only the difference against that
+    ledger is written: +1 for new items, -1 for items that disappeared.
+    All deltas go through a single executemany, inside the caller's write.
+    """
+    current = collect_trends(interests)
+
+    cursor.execute('SELECT trend_type, name FROM trend_contributions WHERE user_id = ?', (user_id,))
+    previous = {(row['trend_type'], row['name']) for row in cursor.fetchall()}
+
+    added = current - previous
+    removed = previous - current
+    if not added and not removed:
+        return
+
+    deltas = Counter(dict.fromkeys(added, 1))
+    deltas.update(dict.fromkeys(removed, -1))
+
+    cursor.executemany('''
+        INSERT INTO global_trends (trend_type, name, count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(trend_type, name) DO UPDATE SET
+        count = count + excluded.count,
+        last_updated = CASE WHEN excluded.count > 0 THEN CURRENT_TIMESTAMP ELSE last_updated END
+    ''', [(trend_type, name, delta) for (trend_type, name), delta in deltas.items()])
+
+    # Drop trends nobody contributes to any more
+    cursor.executemany(
+        'DELETE FROM global_trends WHERE trend_type = ? AND name = ? AND count <= 0',
+        removed
+    )
+    # One bump for the whole write, rather than a trigger firing per row
+    bump_cache_version(cursor, 'trends')
+
+    for (trend_type, name), delta in deltas.items():
+        update_trend_stats(cursor, trend_type, name, delta)
+
+    record_trend_buckets(cursor, deltas, time.time())
+
+    cursor.executemany(
+        'INSERT INTO trend_contributions (user_id, trend_type, name) VALUES (?, ?, ?)',
+        [(user_id, trend_type, name) for trend_type, name in added]
+    )
+    cursor.executemany(
+        'DELETE FROM trend_contributions WHERE user_id = ? AND trend_type = ? AND name = ?',
+        [(user_id, trend_type, name) for trend_type, name in removed]
+    )
+
+def record_trend_buckets(cursor, deltas, now):
+    """Add {(trend_type, name): delta} to the current hour's trend_hourly bucket."""
+    hour_start = int(now) - int(now) % 3600
+    cursor.executemany('''
+        INSERT INTO trend_hourly (hour_start, trend_type, name, delta) VALUES (?, ?, ?, ?)
+        ON CONFLICT(hour_start, trend_type, name) DO UPDATE SET delta = delta + excluded.delta
+    ''', [(hour_start, trend_type, name, delta) for (trend_type, name), delta in deltas.items()])
+    compact_trend_buckets(cursor, now)
+
+def compact_trend_buckets(cursor, now):
+    """Roll hourly buckets older than TREND_HOURLY_RETENTION into daily ones.
+
+    Daily buckets older than TREND_DAILY_RETENTION are dropped. Both steps
+    are range lookups on the bucket start, so running this on every write
+    costs next to nothing when there is nothing to compact.
+    """
+    hour_cutoff = int(now) - TREND_HOURLY_RETENTION
+    hour_cutoff -= hour_cutoff % 3600
+    cursor.execute('''
+        INSERT INTO trend_daily (day_start, trend_type, name, delta)
+        SELECT hour_start - hour_start % 86400, trend_type, name, SUM(delta)
+        FROM trend_hourly
+        WHERE hour_start < ?
+        GROUP BY hour_start - hour_start % 86400, trend_type, name
+        ON CONFLICT(day_start, trend_type, name) DO UPDATE SET delta = delta + excluded.delta
+    ''', (hour_cutoff,))
+    cursor.execute('DELETE FROM trend_hourly WHERE hour_start < ?', (hour_cutoff,))
+    cursor.execute('DELETE FROM trend_daily WHERE day_start < ?', (int(now) - TREND_DAILY_RETENTION,))
+
+def update_trend_stats(cursor, trend_type, name, delta):
+    """Apply a change in a trend's count to its trend_stats row.
+
+    Rank isn't stored, as a stored rank changes for every trend a count
+    moves past; the detail pages count the trends above it on read.
+    """
+    cursor.execute('UPDATE trend_stats SET count = count + ? WHERE trend_type = ? AND name = ?',
+                   (delta, trend_type, name))
+    if cursor.rowcount == 0:
+        if delta <= 0:
+            return
+        _insert_trend_stats(cursor, trend_type, name, delta)
+    elif delta < 0:
+        cursor.execute('DELETE FROM trend_stats WHERE trend_type = ? AND name = ? AND count <= 0',
+                       (trend_type, name))
+
+def _insert_trend_stats(cursor, trend_type, name, count):
+    """Create a trend's trend_stats row with its followers and profile users counted."""
+    tag = normalize_tag(name)
+    followers = 0
+    for table, column, follow_type, prefix in TREND_FOLLOWS:
+        if follow_type == trend_type:
+            cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE {column} = ?', (name[len(prefix):],))
+            followers = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM profile_tags WHERE tag = ?', (tag,))
+    profile_users = cursor.fetchone()[0]
+    cursor.execute(
+        'INSERT INTO trend_stats (trend_type, name, tag, count, followers, profile_users) VALUES (?, ?, ?, ?, ?, ?)',
+        (trend_type, name, tag, count, followers, profile_users)
+    )
+
+def save_upload(file_storage, path, chunk_size=1024 * 1024):
+    """Stream an uploaded file to disk, returning the SHA-256 of its contents."""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        while True:
+            chunk = file_storage.stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
 
 def hash_password(password):
     """Hash a password."""
@@ -0,0 +1,275 @@
+import io
+import json
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Characters read from a zip member per refill of the parse buffer
+CHUNK_SIZE = 64 * 1024
+
+# Top-level keys of an activity log JSON file that we aggregate, and whether
+# we only need the number of entries ('count') or the entries themselves ('list')
+ACTIVITY_KEYS = {
+    'likes': 'count',
+    'comments': 'count',
+    'hashtags_used': 'list',
+    'music_liked': 'list',
+    'accounts_followed': 'list',
+}
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',:]}'
+_decoder = json.JSONDecoder()
+
+
+class JSONStreamReader:
+    """Incremental reader for a JSON document coming from a text stream.
+
+    Only the part of the document currently being parsed is kept in memory,
+    so arrays can be walked element by element and values we don't care
+    about can be skipped without ever materialising them.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Append more text to the buffer, dropping what was already consumed."""
+        if self.eof:
+            return False
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        ch = self.peek()
+        if ch == '' or ch not in chars:
+            raise json.JSONDecodeError(f'Expected one of {chars!r}', self.buf, self.pos)
+        self.pos += 1
+        return ch
+
+    def read_value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Grow the read size with the pending value so huge scalars
+                # don't turn into quadratic re-parsing
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+            # A number or literal may be cut at the buffer edge, even one that
+            # decodes: "1." or "1e" read as 1. Only accept it once a delimiter
+            # follows, or at EOF
+            if self.buf[self.pos] not in '"[{' and not self.eof and (
+                    end == len(self.buf) or self.buf[end] not in _DELIMITERS):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Yield the elements of the array starting at the current position."""
+        self._expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._expect(',]') == ']':
+                return
+
+    def iter_object(self):
+        """Yield the keys of the object starting at the current position.
+
+        After each key the caller must consume the value with read_value(),
+        iter_array() or skip_value() before resuming the iteration.
+        """
+        self._expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise json.JSONDecodeError('Expected object key', self.buf, self.pos)
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def skip_value(self):
+        """Consume the next value, streaming through nested containers."""
+        ch = self.peek()
+        if ch == '[':
+            for _ in self._iter_skipped_array():
+                pass
+        elif ch == '{':
+            for _ in self.iter_object():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def _iter_skipped_array(self):
+        self._expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            self.skip_value()
+            yield
+            if self._expect(',]') == ']':
+                return
+
+
+def parse_activity_member(raw, chunk_size=CHUNK_SIZE):
+    """Stream one JSON member of an activity log export.
+
+    `raw` is a binary file object (e.g. from ZipFile.open), read `chunk_size`
+    characters at a time. Returns a dict with the entry count for 'count' keys
+    and the entries for 'list' keys in ACTIVITY_KEYS. Members whose top level
+    isn't an object yield an empty dict.
+    """
+    reader = JSONStreamReader(io.TextIOWrapper(raw, encoding='utf-8'), chunk_size)
+    partial = {}
+    if reader.peek() != '{':
+        return partial
+
+    for key in reader.iter_object():
+        mode = ACTIVITY_KEYS.get(key)
+        if mode is None:
+            reader.skip_value()
+        elif reader.peek() != '[':
+            value = reader.read_value()
+            if mode == 'count':
+                partial[key] = len(value) if isinstance(value, (dict, str)) else 0
+            elif isinstance(value, dict):
+                partial[key] = list(value)
+        elif mode == 'count':
+            partial[key] = sum(1 for _ in reader.iter_array())
+        else:
+            partial[key] = [item for item in reader.iter_array() if isinstance(item, str)]
+
+    return partial
+
+
+def empty_interests():
+    """Return an interest aggregate with nothing in it."""
+    return {
+        'hashtags': [],
+        'music_liked': [],
+        'trends_followed': [],
+        'celebrities_followed': [],
+        'posts_liked_count': 0,
+        'reels_watched_count': 0,
+        'comments_made_count': 0
+    }
+
+
+def member_interests(partial):
+    """Map step: turn one parsed member into a partial interest aggregate."""
+    interests = empty_interests()
+    interests['posts_liked_count'] = partial.get('likes', 0)
+    interests['comments_made_count'] = partial.get('comments', 0)
+    # Strip # prefixes from hashtags to store them consistently
+    interests['hashtags'] = [tag.lstrip('#') for tag in partial.get('hashtags_used', [])]
+    interests['music_liked'] = partial.get('music_liked', [])
+    interests['celebrities_followed'] = partial.get('accounts_followed', [])
+    return interests
+
+
+def merge_interests(partials):
+    """Reduce step: combine partial aggregates from every member of an export.
+
+    Counts are summed and item lists are unioned in first-seen order, so a
+    key spread over several files is merged instead of the last file winning.
+    """
+    merged = empty_interests()
+    seen = {key: {} for key, value in merged.items() if isinstance(value, list)}
+    for partial in partials:
+        for key, value in partial.items():
+            if key in seen:
+                seen[key].update(dict.fromkeys(value))
+            else:
+                merged[key] += value
+    for key, items in seen.items():
+        merged[key] = list(items)
+    return merged
+
+
+def list_json_members(zip_ref):
+    """Return the ZipInfo of every JSON member, largest first."""
+    members = [info for info in zip_ref.infolist()
+               if not info.is_dir() and info.filename.endswith('.json')]
+    members.sort(key=lambda info: info.file_size, reverse=True)
+    return members
+
+
+def parse_member_at(zip_path, member_name):
+    """Map task run in a worker process: parse one member of the zip at zip_path."""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        with zip_ref.open(member_name) as member:
+            try:
+                return member_interests(parse_activity_member(member))
+            except ValueError:
+                # Malformed JSON or text that isn't UTF-8
+                return empty_interests()
+
+
+def parse_export(zip_path, workers=1, parallel_min_bytes=0, cached=None):
+    """Parse every JSON member of an export into one interest aggregate.
+
+    `cached` maps member names to the (crc32, file_size, partial) recorded for
+    a previous upload; members whose CRC and size are unchanged reuse that
+    partial instead of being parsed again. The rest are spread over a pool of
+    `workers` processes when there is more than one of them and their total
+    uncompressed size is at least `parallel_min_bytes`; smaller batches are
+    parsed inline, where starting a pool would cost more than it saves.
+
+    Returns (interests, members), where members maps every JSON member name
+    to its (crc32, file_size, partial) for caching.
+    """
+    cached = cached or {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        infos = list_json_members(zip_ref)
+
+    members = {}
+    to_parse = []
+    for info in infos:
+        hit = cached.get(info.filename)
+        if hit and hit[0] == info.CRC and hit[1] == info.file_size:
+            members[info.filename] = hit
+        else:
+            members[info.filename] = None
+            to_parse.append(info)
+
+    names = [info.filename for info in to_parse]
+    if workers > 1 and len(names) > 1 and sum(info.file_size for info in to_parse) >= parallel_min_bytes:
+        with ProcessPoolExecutor(max_workers=min(workers, len(names))) as executor:
+            partials = list(executor.map(parse_member_at, [zip_path] * len(names), names))
+    else:
+        partials = [parse_member_at(zip_path, name) for name in names]
+
+    for info, partial in zip(to_parse, partials):
+        members[info.filename] = (info.CRC, info.file_size, partial)
+
+    return merge_interests(member[2] for member in members.values()), members
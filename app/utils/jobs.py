@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, current_app
+from app.utils.db import get_db, close_db, run_write, execute_write
+from app.utils.helpers import process_zip_file
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Minimal app used inside worker processes to give helpers an app context
+_worker_app = None
+
+# A queued or running job whose worker has gone quiet for longer than the
+# timeout (bound as "-<seconds> seconds"); most likely its process died
+STALE_JOB = "status IN ('queued', 'running') AND COALESCE(started_at, created_at) < datetime('now', ?)"
+STALE_MESSAGE = 'Processing did not finish in time. Please upload your activity logs again.'
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            config = {key: value for key, value in app.config.items() if key.isupper()}
+            # Spawned, not forked: this process already runs the writer thread
+            # and holds pooled connections, which a fork would copy mid-use
+            _executor = ProcessPoolExecutor(
+                max_workers=app.config['INGEST_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(config,)
+            )
+    return _executor
+
+
+def _init_worker(config):
+    global _worker_app
+    _worker_app = Flask(__name__)
+    _worker_app.config.update(config)
+
+
+def _finish_job(cursor, job_id, status, message):
+    cursor.execute('''
+        UPDATE ingest_jobs SET status = ?, message = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (status, message, job_id))
+    if status == 'done':
+        cursor.execute('''
+            UPDATE activity_logs SET processed = TRUE
+            WHERE id = (SELECT activity_log_id FROM ingest_jobs WHERE id = ?)
+        ''', (job_id,))
+
+
+def _run_job(job_id, zip_path, user_id):
+    """Process one uploaded export inside a worker process."""
+    with _worker_app.app_context():
+        try:
+            execute_write(
+                "UPDATE ingest_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job_id,)
+            )
+
+            try:
+                success, message = process_zip_file(zip_path, user_id)
+            finally:
+                # Clean up uploaded file
+                if os.path.exists(zip_path):
+                    os.remove(zip_path)
+
+            run_write(_finish_job, job_id, 'done' if success else 'failed', message)
+        finally:
+            close_db()
+
+
+def is_duplicate_upload(user_id, content_hash):
+    """Check whether the user's most recently processed upload had the same contents."""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT content_hash FROM activity_logs
+        WHERE user_id = ? AND processed = TRUE
+        ORDER BY id DESC LIMIT 1
+    ''', (user_id,))
+    latest = cursor.fetchone()
+    return latest is not None and latest['content_hash'] == content_hash
+
+
+def enqueue_ingest_job(user_id, zip_path, zip_filename, content_hash=None):
+    """Record an uploaded export and hand it to the ingestion worker pool.
+
+    Returns the id of the new ingest_jobs row, which can be polled through
+    /api/jobs/<id> until its status is 'done' or 'failed'.
+    """
+    def record_upload(cursor):
+        cursor.execute(
+            'INSERT INTO activity_logs (user_id, zip_filename, processed, content_hash) VALUES (?, ?, ?, ?)',
+            (user_id, zip_filename, False, content_hash)
+        )
+        cursor.execute(
+            'INSERT INTO ingest_jobs (user_id, activity_log_id) VALUES (?, ?)',
+            (user_id, cursor.lastrowid)
+        )
+        return cursor.lastrowid
+
+    job_id = run_write(record_upload)
+
+    app = current_app._get_current_object()
+    future = _get_executor(app).submit(_run_job, job_id, zip_path, user_id)
+
+    def on_done(future):
+        # The worker records its own outcome; this only catches jobs whose
+        # worker died (e.g. BrokenProcessPool) before it could do so
+        error = future.exception()
+        if error is None:
+            return
+        with app.app_context():
+            run_write(_finish_job, job_id, 'failed', f"Error processing zip file: {error}")
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    future.add_done_callback(on_done)
+    return job_id
+
+
+def _timeout_modifier():
+    return f"-{current_app.config['INGEST_JOB_TIMEOUT']} seconds"
+
+
+def fail_stale_jobs(cursor, timeout):
+    """Mark jobs left queued or running for over timeout seconds as failed.
+
+    Run at startup: jobs belong to the worker pool of the process that
+    queued them, so a restart leaves them unfinished forever. Other server
+    processes may still be running their own jobs, which is why only jobs
+    past the timeout are failed rather than every unfinished one.
+    """
+    cursor.execute(f'''
+        UPDATE ingest_jobs SET status = 'failed', message = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE {STALE_JOB}
+    ''', (STALE_MESSAGE, f'-{timeout} seconds'))
+
+
+def get_job(job_id, user_id):
+    """Return the ingest job row if it belongs to the given user.
+
+    A job past INGEST_JOB_TIMEOUT is reported as failed even before
+    fail_stale_jobs records it.
+    """
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT id,
+               CASE WHEN {STALE_JOB} THEN 'failed' ELSE status END as status,
+               CASE WHEN {STALE_JOB} THEN ? ELSE message END as message,
+               created_at, started_at, finished_at
+        FROM ingest_jobs WHERE id = ? AND user_id = ?
+    ''', (_timeout_modifier(), _timeout_modifier(), STALE_MESSAGE, job_id, user_id))
+    return cursor.fetchone()
+
+
+def get_pending_job(user_id):
+    """Return the user's most recent job that hasn't finished or timed out yet, if any."""
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT id, status FROM ingest_jobs
+        WHERE user_id = ? AND status IN ('queued', 'running') AND NOT ({STALE_JOB})
+        ORDER BY id DESC LIMIT 1
+    ''', (user_id, _timeout_modifier()))
+    return cursor.fetchone()
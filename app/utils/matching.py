@@ -0,0 +1,245 @@
+import json
+from flask import current_app
+from app.utils.db import get_db
+from app.utils.minhash import lsh_candidates
+
+# Per-kind item counts of the users in `shared`, and the final scoring. A
+# user's score is the same as calculate_interest_match: shared items out of
+# the sum, over kinds, of the larger of the two users' item counts.
+_SCORE_SHARED = '''
+    their_counts AS (
+        SELECT uii.user_id, uii.kind, COUNT(*) as n
+        FROM user_interest_items uii
+        WHERE uii.user_id IN (SELECT user_id FROM shared)
+        GROUP BY uii.user_id, uii.kind
+    ),
+    excess AS (
+        SELECT tc.user_id, SUM(MAX(0, tc.n - COALESCE(mc.n, 0))) as n
+        FROM their_counts tc
+        LEFT JOIN my_counts mc ON mc.kind = tc.kind
+        GROUP BY tc.user_id
+    )
+    SELECT s.user_id, s.shared,
+           s.shared * 100 / ((SELECT COUNT(*) FROM mine) + e.n) as score,
+           COUNT(*) OVER () as total
+    FROM shared s
+    JOIN excess e ON e.user_id = s.user_id
+    ORDER BY score DESC, s.shared DESC, s.user_id
+    LIMIT :limit OFFSET :offset
+'''
+
+# Scores every user sharing at least one interest item with :user_id, using the
+# (item_id, user_id) index on user_interest_items as the item -> users inverted
+# index.
+TOP_MATCHES_QUERY = '''
+    WITH mine AS (
+        SELECT kind, item_id FROM user_interest_items WHERE user_id = :user_id
+    ),
+    my_counts AS (
+        SELECT kind, COUNT(*) as n FROM mine GROUP BY kind
+    ),
+    shared AS (
+        SELECT o.user_id, COUNT(*) as shared
+        FROM mine m
+        JOIN user_interest_items o ON o.item_id = m.item_id AND o.kind = m.kind
+        WHERE o.user_id != :user_id
+        GROUP BY o.user_id
+    ),
+''' + _SCORE_SHARED
+
+# Scores only the users in the JSON array :candidates, walking each
+# candidate's own items instead of the posting lists of :user_id's items, so
+# popular items don't pull in every user who has them.
+CANDIDATE_MATCHES_QUERY = '''
+    WITH mine AS (
+        SELECT kind, item_id FROM user_interest_items WHERE user_id = :user_id
+    ),
+    my_counts AS (
+        SELECT kind, COUNT(*) as n FROM mine GROUP BY kind
+    ),
+    shared AS (
+        SELECT o.user_id, COUNT(*) as shared
+        FROM json_each(:candidates) c
+        JOIN user_interest_items o ON o.user_id = c.value
+        JOIN mine m ON m.item_id = o.item_id AND m.kind = o.kind
+        WHERE o.user_id != :user_id
+        GROUP BY o.user_id
+    ),
+''' + _SCORE_SHARED
+
+
+def top_matches(user_id, limit=20, offset=0):
+    """Return a page of the users most similar to user_id.
+
+    Only users who share at least one interest item are considered. Returns
+    (matches, total) where matches is a list of (other_user_id, match_percent)
+    ordered best first and total is the number of candidates across all pages.
+
+    The app reads stored lists instead; this is the exact ranking they are
+    checked against, kept for benchmarks/bench_mutuals.py and for verifying
+    user_matches and approx_top_matches by hand.
+    """
+    cursor = get_db().cursor()
+    cursor.execute(TOP_MATCHES_QUERY, {'user_id': user_id, 'limit': limit, 'offset': offset})
+    rows = cursor.fetchall()
+    total = rows[0]['total'] if rows else 0
+    return [(row['user_id'], row['score']) for row in rows], total
+
+
+def approx_top_matches(user_id, limit=20, offset=0):
+    """Approximate top_matches using MinHash/LSH candidate generation.
+
+    Only users sharing an LSH bucket with user_id are scored (exactly), so
+    similar users can be missed but the cost no longer grows with how popular
+    the user's items are. The recall/latency trade-off is set by LSH_BANDS
+    and LSH_MAX_CANDIDATES. Returns the same (matches, total) as top_matches.
+    """
+    config = current_app.config
+    cursor = get_db().cursor()
+    candidates = lsh_candidates(cursor, user_id, config['LSH_BANDS'], config['LSH_MAX_CANDIDATES'])
+    if not candidates:
+        return [], 0
+
+    cursor.execute(CANDIDATE_MATCHES_QUERY, {
+        'user_id': user_id, 'candidates': json.dumps(candidates), 'limit': limit, 'offset': offset
+    })
+    rows = cursor.fetchall()
+    total = rows[0]['total'] if rows else 0
+    return [(row['user_id'], row['score']) for row in rows], total
+
+
+def _mark_computed(cursor, user_id):
+    cursor.execute('INSERT OR REPLACE INTO user_matches_state (user_id) VALUES (?)', (user_id,))
+
+
+def store_top_matches(cursor, user_id, top_n):
+    """Recompute user_id's rows in user_matches from scratch."""
+    cursor.execute('DELETE FROM user_matches WHERE user_id = ?', (user_id,))
+    cursor.execute(TOP_MATCHES_QUERY, {'user_id': user_id, 'limit': top_n, 'offset': 0})
+    cursor.executemany(
+        'INSERT INTO user_matches (user_id, other_id, score, shared) VALUES (?, ?, ?, ?)',
+        [(user_id, row['user_id'], row['score'], row['shared']) for row in cursor.fetchall()]
+    )
+    _mark_computed(cursor, user_id)
+
+
+def backfill_user_matches(cursor, top_n):
+    """Compute the lists of users who have none marked computed yet."""
+    cursor.execute('SELECT id FROM users WHERE id NOT IN (SELECT user_id FROM user_matches_state)')
+    for row in cursor.fetchall():
+        store_top_matches(cursor, row['id'], top_n)
+
+
+def refresh_user_matches(cursor, user_id, top_n):
+    """Bring user_matches up to date after user_id's interest items changed.
+
+    user_id's own list is recomputed. Since a match is symmetric, the new
+    scores against every user sharing items with user_id also say how those
+    users' lists change: a raised score is updated in place, a new score
+    better than a list's worst entry replaces it, and users whose row for
+    user_id got worse or disappeared have their list recomputed, as someone
+    outside it may now rank higher. Users whose list was never computed
+    are skipped; readers compute theirs without storing it until
+    backfill_user_matches or their own next upload does.
+    """
+    # Scores against everyone sharing items with user_id, best first
+    cursor.execute(TOP_MATCHES_QUERY, {'user_id': user_id, 'limit': -1, 'offset': 0})
+    scores = {row['user_id']: (row['score'], row['shared']) for row in cursor.fetchall()}
+
+    cursor.execute('DELETE FROM user_matches WHERE user_id = ?', (user_id,))
+    cursor.executemany(
+        'INSERT INTO user_matches (user_id, other_id, score, shared) VALUES (?, ?, ?, ?)',
+        [(user_id, other_id, score, shared) for other_id, (score, shared) in list(scores.items())[:top_n]]
+    )
+    _mark_computed(cursor, user_id)
+
+    # Rows other users hold for user_id
+    cursor.execute('SELECT user_id, score, shared FROM user_matches WHERE other_id = ?', (user_id,))
+    held = {row['user_id']: (row['score'], row['shared']) for row in cursor.fetchall()}
+
+    recompute = [other_id for other_id, old in held.items()
+                 if other_id not in scores or scores[other_id] < old]
+    raised = [(score, shared, other_id, user_id) for other_id, (score, shared) in scores.items()
+              if other_id in held and (score, shared) > held[other_id]]
+
+    # Size and worst entry of the computed lists user_id isn't in yet
+    newcomers = json.dumps([other_id for other_id in scores if other_id not in held])
+    cursor.execute('''
+        SELECT s.user_id, w.other_id, w.score, w.shared, COALESCE(w.n, 0) as n
+        FROM json_each(?) j
+        JOIN user_matches_state s ON s.user_id = j.value
+        LEFT JOIN (
+            SELECT m.user_id, m.other_id, m.score, m.shared,
+                   ROW_NUMBER() OVER (PARTITION BY m.user_id ORDER BY m.score, m.shared, m.other_id DESC) as rn,
+                   COUNT(*) OVER (PARTITION BY m.user_id) as n
+            FROM user_matches m
+            WHERE m.user_id IN (SELECT value FROM json_each(?))
+        ) w ON w.user_id = s.user_id AND w.rn = 1
+    ''', (newcomers, newcomers))
+
+    inserts, evicted = [], []
+    for row in cursor.fetchall():
+        score, shared = scores[row['user_id']]
+        if row['n'] >= top_n:
+            if (score, shared, -user_id) <= (row['score'], row['shared'], -row['other_id']):
+                continue
+            evicted.append((row['user_id'], row['other_id']))
+        inserts.append((row['user_id'], user_id, score, shared))
+
+    cursor.executemany('UPDATE user_matches SET score = ?, shared = ? WHERE user_id = ? AND other_id = ?', raised)
+    cursor.executemany('DELETE FROM user_matches WHERE user_id = ? AND other_id = ?', evicted)
+    cursor.executemany('INSERT INTO user_matches (user_id, other_id, score, shared) VALUES (?, ?, ?, ?)', inserts)
+    for other_id in recompute:
+        store_top_matches(cursor, other_id, top_n)
+
+
+# Columns the mutuals page can be sorted by, ahead of the match ranking
+MATCH_SORTS = {
+    'followers': 'us.followers DESC,',
+    'alphabetical': 'u.username COLLATE NOCASE,',
+    'match': '',
+}
+
+
+def user_matches_source(user_id):
+    """SQL yielding user_id's top matches as (other_id, score, shared) rows, and its parameters.
+
+    Reads the stored list once it has been computed, empty or not. Until
+    then the list is computed here without being stored, as this runs on
+    GET requests, which never write.
+    """
+    cursor = get_db().cursor()
+    cursor.execute('SELECT 1 FROM user_matches_state WHERE user_id = ?', (user_id,))
+    if cursor.fetchone():
+        return 'SELECT other_id, score, shared FROM user_matches WHERE user_id = ?', (user_id,)
+
+    cursor.execute(TOP_MATCHES_QUERY, {'user_id': user_id, 'limit': current_app.config['MATCHES_TOP_N'], 'offset': 0})
+    rows = [[row['user_id'], row['score'], row['shared']] for row in cursor.fetchall()]
+    return '''
+        SELECT json_extract(value, '$[0]') as other_id, json_extract(value, '$[1]') as score,
+               json_extract(value, '$[2]') as shared
+        FROM json_each(?)
+    ''', (json.dumps(rows),)
+
+def stored_matches(user_id, sort_by='match', limit=20, offset=0):
+    """Return a page of user_id's precomputed matches joined with the users.
+
+    Returns (rows, total) where rows carry id, username, profile_image_url,
+    match_percent, followers and following.
+    """
+    source, params = user_matches_source(user_id)
+
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+        SELECT u.id, u.username, u.profile_image_url, m.score as match_percent,
+               us.followers, us.following,
+               COUNT(*) OVER () as total
+        FROM ({source}) m
+        JOIN users u ON u.id = m.other_id
+        JOIN user_stats us ON us.user_id = u.id
+        ORDER BY {MATCH_SORTS.get(sort_by, '')} m.score DESC, m.shared DESC, m.other_id
+        LIMIT ? OFFSET ?
+    ''', params + (limit, offset))
+    rows = cursor.fetchall()
+    total = rows[0]['total'] if rows else 0
+    return rows, total
@@ -0,0 +1,631 @@
+"""Versioned schema migrations.
+
+The schema version is kept in PRAGMA user_version. Each migration runs in
+its own transaction together with the version bump, so a database is always
+at exactly one version. Migrations are only ever appended to MIGRATIONS;
+never edit or reorder one that has shipped.
+"""
+from app.utils.db import transaction, add_column_if_missing, FOLLOW_COUNTERS, TREND_FOLLOWS
+
+MIGRATIONS = []
+
+
+def migration(fn):
+    """Register fn(cursor) as the next schema version."""
+    MIGRATIONS.append(fn)
+    return fn
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def run_migrations(db):
+    """Apply every migration newer than the database's version.
+
+    Returns the names of the migrations applied. The version is re-read
+    inside each migration's transaction, so processes starting at the same
+    time don't apply a migration twice.
+    """
+    applied = []
+    while True:
+        with transaction(db):
+            version = schema_version(db)
+            if version > len(MIGRATIONS):
+                raise RuntimeError(f'Database schema version {version} is newer than this code ({len(MIGRATIONS)})')
+            if version == len(MIGRATIONS):
+                break
+            migrate = MIGRATIONS[version]
+            migrate(db.cursor())
+            db.execute(f'PRAGMA user_version = {version + 1}')
+        applied.append(migrate.__name__)
+    return applied
+
+
+@migration
+def baseline(cursor):
+    """Tables created by init_db before versioned migrations existed.
+
+    Everything is IF NOT EXISTS, so databases created by earlier releases
+    (still at version 0) converge on the same schema.
+    """
+    # Create Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            profile_image_url TEXT,
+            bio TEXT,
+            profile_hashtags TEXT
+        )
+    ''')
+
+    # Create ActivityLogs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            zip_filename TEXT NOT NULL,
+            processed BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Hash of the uploaded zip, used to skip re-processing identical uploads
+    add_column_if_missing(cursor, 'activity_logs', 'content_hash', 'TEXT')
+
+    # Create ExportMembers table (per-member CRC and parse result of a user's last upload)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_members (
+            user_id INTEGER NOT NULL,
+            member_name TEXT NOT NULL,
+            crc32 INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            partial TEXT NOT NULL,  -- JSON interest aggregate for this member
+            PRIMARY KEY (user_id, member_name),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Create IngestJobs table (background processing of activity_logs uploads)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            activity_log_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued/running/done/failed
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (activity_log_id) REFERENCES activity_logs (id)
+        )
+    ''')
+
+    # Create UserInterests table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_interests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            hashtags TEXT,  -- JSON array
+            music_liked TEXT,  -- JSON array
+            trends_followed TEXT,  -- JSON array
+            celebrities_followed TEXT,  -- JSON array
+            posts_liked_count INTEGER DEFAULT 0,
+            reels_watched_count INTEGER DEFAULT 0,
+            comments_made_count INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Create GlobalTrends table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS global_trends (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trend_type TEXT NOT NULL,  -- hashtag/music/creator/topic
+            name TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(trend_type, name)
+        )
+    ''')
+
+    # Create TrendContributions table (ledger of what each user added to global_trends)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trend_contributions (
+            user_id INTEGER NOT NULL,
+            trend_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (user_id, trend_type, name),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Create InterestItems table (one row per distinct hashtag/song/trend/creator)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS interest_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,  -- hashtag/music/trend/creator
+            name TEXT NOT NULL,
+            UNIQUE(kind, name)
+        )
+    ''')
+
+    # Create UserInterestItems table (normalized form of the user_interests JSON arrays)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_interest_items (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, kind, item_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (item_id) REFERENCES interest_items (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_interest_items_item
+        ON user_interest_items (item_id, user_id)
+    ''')
+
+    # Create UserMatches table (each user's precomputed top-N interest matches)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_matches (
+            user_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,  -- match percentage
+            PRIMARY KEY (user_id, other_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (other_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Shared item count, the tie-break between equal scores
+    add_column_if_missing(cursor, 'user_matches', 'shared', 'INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_matches_other
+        ON user_matches (other_id, user_id)
+    ''')
+
+    # Create UserMinhash table (MinHash signature of each user's interest items)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_minhash (
+            user_id INTEGER PRIMARY KEY,
+            signature BLOB NOT NULL,  -- MINHASH_PERMUTATIONS signed 64-bit ints
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Create LshBuckets table (banded LSH buckets of the signatures)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Create Follows table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS follows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            follower_id INTEGER NOT NULL,
+            following_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (follower_id) REFERENCES users (id),
+            FOREIGN KEY (following_id) REFERENCES users (id),
+            UNIQUE(follower_id, following_id)
+        )
+    ''')
+
+    # Create HashtagFollows table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hashtag_follows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            hashtag_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, hashtag_name)
+        )
+    ''')
+
+    # Create MusicFollows table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS music_follows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            song_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, song_name)
+        )
+    ''')
+
+    # Create CreatorFollows table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS creator_follows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            creator_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, creator_name)
+        )
+    ''')
+
+    # Create UserStats table (follow counters kept exact by the triggers below)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            followers INTEGER NOT NULL DEFAULT 0,
+            following INTEGER NOT NULL DEFAULT 0,  -- users followed
+            hashtag_following INTEGER NOT NULL DEFAULT 0,
+            music_following INTEGER NOT NULL DEFAULT 0,
+            creator_following INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_stats_user_insert AFTER INSERT ON users BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_stats_user_delete AFTER DELETE ON users BEGIN
+            DELETE FROM user_stats WHERE user_id = OLD.id;
+        END
+    ''')
+    for table, user_column, counter in FOLLOW_COUNTERS:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS user_stats_{table}_{counter}_insert AFTER INSERT ON {table} BEGIN
+                UPDATE user_stats SET {counter} = {counter} + 1 WHERE user_id = NEW.{user_column};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS user_stats_{table}_{counter}_delete AFTER DELETE ON {table} BEGIN
+                UPDATE user_stats SET {counter} = {counter} - 1 WHERE user_id = OLD.{user_column};
+            END
+        ''')
+
+
+@migration
+def hot_path_indexes(cursor):
+    """Indexes for the follow, trend and job lookups that used to scan their table."""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_follows_following ON follows (following_id, follower_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_hashtag_follows_name ON hashtag_follows (hashtag_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_music_follows_name ON music_follows (song_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_creator_follows_name ON creator_follows (creator_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_global_trends_type_count ON global_trends (trend_type, count DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_global_trends_count ON global_trends (count DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_logs_user ON activity_logs (user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_user ON ingest_jobs (user_id, id)')
+
+
+@migration
+def user_search_index(cursor):
+    """FTS5 trigram index over usernames and bios for /mutuals/search.
+
+    user_search is an external-content table over users, so it stores only
+    the index; triggers keep it in step with inserts, deletes and edits. The
+    NOCASE username index serves prefix lookups shorter than one trigram.
+    """
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+            username, bio, content='users', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON users BEGIN
+            INSERT INTO user_search (rowid, username, bio) VALUES (NEW.id, NEW.username, NEW.bio);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON users BEGIN
+            INSERT INTO user_search (user_search, rowid, username, bio) VALUES ('delete', OLD.id, OLD.username, OLD.bio);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_search_update AFTER UPDATE OF username, bio ON users BEGIN
+            INSERT INTO user_search (user_search, rowid, username, bio) VALUES ('delete', OLD.id, OLD.username, OLD.bio);
+            INSERT INTO user_search (rowid, username, bio) VALUES (NEW.id, NEW.username, NEW.bio);
+        END
+    ''')
+    cursor.execute("INSERT INTO user_search (user_search) VALUES ('rebuild')")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)')
+
+
+@migration
+def profile_tags_index(cursor):
+    """Tokenized (tag, user_id) form of users.profile_hashtags.
+
+    Replaces the profile_hashtags LIKE '%name%' scans on the trend pages with
+    exact lookups. Rows are kept in step by sync_profile_tags wherever
+    profile_hashtags is written.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profile_tags (
+            tag TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_profile_tags_user ON profile_tags (user_id)')
+    cursor.execute("SELECT id, profile_hashtags FROM users WHERE profile_hashtags IS NOT NULL AND profile_hashtags != ''")
+    # Tokenized as helpers.profile_tags did when this shipped, copied here
+    # so later changes to the helper can't change what this migration writes
+    rows = set()
+    for user_id, profile_hashtags in cursor.fetchall():
+        for tag in profile_hashtags.split(','):
+            tag = tag.strip().lstrip('#@').strip().lower()
+            if tag:
+                rows.add((tag, user_id))
+    cursor.executemany('INSERT OR IGNORE INTO profile_tags (tag, user_id) VALUES (?, ?)', rows)
+
+
+@migration
+def trend_stats_table(cursor):
+    """Per-trend rank, follower and profile-user counts for the trend detail pages.
+
+    count mirrors global_trends and rank is 1 + the number of trends of the
+    same type with a higher count; update_global_trends shifts both
+    incrementally. followers and profile_users are kept by the triggers
+    below. init_db fills the table through backfill_trend_stats.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trend_stats (
+            trend_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            tag TEXT NOT NULL,  -- normalize_tag(name), as stored in profile_tags
+            count INTEGER NOT NULL DEFAULT 0,
+            rank INTEGER NOT NULL DEFAULT 1,
+            followers INTEGER NOT NULL DEFAULT 0,
+            profile_users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (trend_type, name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trend_stats_type_count ON trend_stats (trend_type, count)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trend_stats_tag ON trend_stats (tag)')
+
+    for event, row, step in (('insert', 'NEW', '+ 1'), ('delete', 'OLD', '- 1')):
+        for table, column, trend_type, prefix in TREND_FOLLOWS:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trend_stats_{table}_{event} AFTER {event.upper()} ON {table} BEGIN
+                    UPDATE trend_stats SET followers = followers {step}
+                    WHERE trend_type = '{trend_type}' AND name = '{prefix}' || {row}.{column};
+                END
+            ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trend_stats_profile_tags_{event} AFTER {event.upper()} ON profile_tags BEGIN
+                UPDATE trend_stats SET profile_users = profile_users {step} WHERE tag = {row}.tag;
+            END
+        ''')
+
+
+@migration
+def cache_versions_table(cursor):
+    """Version counters that invalidate the per-process caches in app.utils.cache.
+
+    'trends' moves on every change to global_trends, whether it comes from
+    update_global_trends or the startup seed.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name) VALUES ('trends')")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS cache_versions_global_trends_{event.lower()} AFTER {event} ON global_trends BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'trends';
+            END
+        ''')
+
+
+@migration
+def trend_buckets(cursor):
+    """Hourly and daily rollups of global_trends count changes.
+
+    update_global_trends adds each change to the current hour's bucket and
+    compacts hours past their retention into days, so "trending now" scores
+    sum a bounded number of pre-aggregated rows instead of raw events.
+    Bucket starts are Unix timestamps. Also indexes the recent and A-Z sorts.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trend_hourly (
+            hour_start INTEGER NOT NULL,
+            trend_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            delta INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour_start, trend_type, name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trend_daily (
+            day_start INTEGER NOT NULL,
+            trend_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            delta INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day_start, trend_type, name)
+        ) WITHOUT ROWID
+    ''')
+
+    # The other /home sorts, which scanned global_trends
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_global_trends_updated ON global_trends (last_updated DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_global_trends_type_updated ON global_trends (trend_type, last_updated DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_global_trends_name ON global_trends (name)')
+
+
+@migration
+def foryou_feed_versions(cursor):
+    """Per-user 'foryou:<user_id>' cache versions for the cached For You feeds.
+
+    Bumped by any change to the user's interest items, followed users or
+    followed trends, which is everything rank_foryou excludes or weighs.
+    """
+    sources = [('user_interest_items', 'user_id'), ('follows', 'follower_id')]
+    sources += [(table, 'user_id') for table, _, _, _ in TREND_FOLLOWS]
+    for table, user_column in sources:
+        for event, row in (('insert', 'NEW'), ('delete', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS cache_versions_foryou_{table}_{event} AFTER {event.upper()} ON {table} BEGIN
+                    INSERT INTO cache_versions (name, version) VALUES ('foryou:' || {row}.{user_column}, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1;
+                END
+            ''')
+
+
+@migration
+def item_related_table(cursor):
+    """Top-N co-occurring items per interest item, for "people who like X also like Y".
+
+    users is how many users have both items. interest_items.users, kept by
+    the triggers below, is each item's own user count, so the share of an
+    item's users who like a related one is one division away. Filled by
+    backfill_item_related on startup and maintained by refresh_item_related.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_related (
+            item_id INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (item_id, related_id),
+            FOREIGN KEY (item_id) REFERENCES interest_items (id),
+            FOREIGN KEY (related_id) REFERENCES interest_items (id)
+        ) WITHOUT ROWID
+    ''')
+
+    add_column_if_missing(cursor, 'interest_items', 'users', 'INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE interest_items SET users = (
+            SELECT COUNT(*) FROM user_interest_items WHERE item_id = interest_items.id
+        )
+    ''')
+    for event, row, step in (('insert', 'NEW', '+ 1'), ('delete', 'OLD', '- 1')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS interest_items_users_{event} AFTER {event.upper()} ON user_interest_items BEGIN
+                UPDATE interest_items SET users = users {step} WHERE id = {row}.item_id;
+            END
+        ''')
+
+
+@migration
+def follow_graph_version(cursor):
+    """'follows' cache version for the per-process follow graph in app.utils.graph.
+
+    Bumped by every follows insert and delete, so a process can tell whether
+    its graph is current, or behind by exactly a change it made itself.
+    """
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name) VALUES ('follows')")
+    for event in ('INSERT', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS cache_versions_follows_{event.lower()} AFTER {event} ON follows BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'follows';
+            END
+        ''')
+
+
+@migration
+def trend_rank_on_read(cursor):
+    """Drop trend_stats.rank; a trend's rank is now counted on read.
+
+    Keeping the stored rank current meant rewriting every trend tied with
+    one whose count moved. The (trend_type, count) index answers the number
+    of trends with a higher count directly.
+    """
+    cursor.execute('PRAGMA table_info(trend_stats)')
+    if 'rank' in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE trend_stats DROP COLUMN rank')
+
+
+@migration
+def user_matches_state(cursor):
+    """Users whose user_matches list has been computed, even if it came out empty.
+
+    Lets readers tell an empty list from one never computed without
+    recomputing it on every view. Lists already stored count as computed;
+    init_db computes the rest through backfill_user_matches.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_matches_state (
+            user_id INTEGER PRIMARY KEY,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO user_matches_state (user_id) SELECT DISTINCT user_id FROM user_matches')
+
+
+@migration
+def trends_version_per_write(cursor):
+    """Bump the 'trends' cache version once per write instead of once per row.
+
+    The row triggers made every upload bump it once per changed trend.
+    update_global_trends and the startup seed now bump it themselves.
+    """
+    for event in ('insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS cache_versions_global_trends_{event}')
+
+
+@migration
+def trend_count_histogram(cursor):
+    """Number of trends of each type at each count, for ranking on read.
+
+    A trend's rank is 1 + the trends of its type with a higher count: a sum
+    over the distinct counts above it, of which there are far fewer than
+    trends. The triggers below keep it in step with trend_stats.count, so a
+    count moving by one touches two rows instead of re-ranking tie groups.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trend_count_histogram (
+            trend_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            trends INTEGER NOT NULL,
+            PRIMARY KEY (trend_type, count)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM trend_count_histogram')
+    cursor.execute('''
+        INSERT INTO trend_count_histogram (trend_type, count, trends)
+        SELECT trend_type, count, COUNT(*) FROM trend_stats GROUP BY trend_type, count
+    ''')
+
+    add = '''
+        INSERT INTO trend_count_histogram (trend_type, count, trends) VALUES (NEW.trend_type, NEW.count, 1)
+        ON CONFLICT(trend_type, count) DO UPDATE SET trends = trends + 1;
+    '''
+    remove = '''
+        UPDATE trend_count_histogram SET trends = trends - 1 WHERE trend_type = OLD.trend_type AND count = OLD.count;
+        DELETE FROM trend_count_histogram WHERE trend_type = OLD.trend_type AND count = OLD.count AND trends <= 0;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trend_count_histogram_insert AFTER INSERT ON trend_stats BEGIN {add} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trend_count_histogram_delete AFTER DELETE ON trend_stats BEGIN {remove} END')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trend_count_histogram_update AFTER UPDATE OF count ON trend_stats
+        WHEN OLD.count != NEW.count BEGIN {remove} {add} END
+    ''')
+
+
+@migration
+def normalize_hashtag_contributions(cursor):
+    """Rename '##tag' trend_contributions rows written by the old backfill to '#tag'.
+
+    backfill_interest_tables prefixed '#' to seeded hashtags that already
+    had one, so those contributions didn't match the global_trends rows
+    update_global_trends writes for the same hashtag.
+    """
+    cursor.execute('''
+        UPDATE OR IGNORE trend_contributions SET name = '#' || ltrim(name, '#')
+        WHERE trend_type = 'hashtag' AND name LIKE '##%'
+    ''')
+    # Users who already had the '#tag' row too
+    cursor.execute("DELETE FROM trend_contributions WHERE trend_type = 'hashtag' AND name LIKE '##%'")
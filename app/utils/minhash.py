@@ -0,0 +1,128 @@
+"""MinHash signatures and banded LSH buckets over users' interest items.
+
+Each user's set of interest item ids is summarised by a MinHash signature of
+MINHASH_PERMUTATIONS values. The signature is cut into LSH_BANDS bands and
+every band is hashed to a bucket in lsh_buckets, so users whose item sets are
+similar (by Jaccard similarity) are likely to share at least one bucket.
+More bands with fewer rows each raise recall at the cost of more candidates.
+"""
+import hashlib
+import random
+from array import array
+from collections import Counter
+from functools import lru_cache
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app.utils.db import run_write
+
+# Mersenne prime used for the universal hash family h(x) = (a * x + b) mod p
+_PRIME = (1 << 61) - 1
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm, seed=42):
+    rng = random.Random(seed)
+    return [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+
+def minhash_signature(item_ids, num_perm):
+    """Return the MinHash signature of a set of integer item ids, or None if it is empty."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return None
+    return [min((a * item_id + b) % _PRIME for item_id in item_ids)
+            for a, b in _permutations(num_perm)]
+
+
+def band_buckets(signature, bands):
+    """Hash each band of a signature to a signed 64-bit bucket id.
+
+    Returns a list of (band, bucket) pairs. Trailing signature values that
+    don't fill a whole band are ignored.
+    """
+    rows = len(signature) // bands
+    buckets = []
+    for band in range(bands):
+        values = array('q', signature[band * rows:(band + 1) * rows]).tobytes()
+        digest = hashlib.blake2b(values, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'big', signed=True)))
+    return buckets
+
+
+def _load_signature(cursor, user_id):
+    cursor.execute('SELECT signature FROM user_minhash WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return list(array('q', row['signature'])) if row else None
+
+
+def update_user_minhash(cursor, user_id, num_perm, bands):
+    """Recompute a user's signature from user_interest_items and move their LSH buckets."""
+    old_signature = _load_signature(cursor, user_id)
+    if old_signature is not None:
+        cursor.executemany(
+            'DELETE FROM lsh_buckets WHERE band = ? AND bucket = ? AND user_id = ?',
+            [(band, bucket, user_id) for band, bucket in band_buckets(old_signature, bands)]
+        )
+
+    cursor.execute('SELECT item_id FROM user_interest_items WHERE user_id = ?', (user_id,))
+    signature = minhash_signature((row['item_id'] for row in cursor.fetchall()), num_perm)
+    if signature is None:
+        cursor.execute('DELETE FROM user_minhash WHERE user_id = ?', (user_id,))
+        return
+
+    cursor.execute(
+        'INSERT OR REPLACE INTO user_minhash (user_id, signature) VALUES (?, ?)',
+        (user_id, array('q', signature).tobytes())
+    )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO lsh_buckets (band, bucket, user_id) VALUES (?, ?, ?)',
+        [(band, bucket, user_id) for band, bucket in band_buckets(signature, bands)]
+    )
+
+
+def rebuild_lsh_index(cursor, num_perm, bands):
+    """Recompute signatures and buckets for every user, e.g. after changing the LSH settings."""
+    cursor.execute('DELETE FROM lsh_buckets')
+    cursor.execute('DELETE FROM user_minhash')
+    cursor.execute('SELECT DISTINCT user_id FROM user_interest_items')
+    user_ids = [row['user_id'] for row in cursor.fetchall()]
+    for user_id in user_ids:
+        update_user_minhash(cursor, user_id, num_perm, bands)
+    return len(user_ids)
+
+
+def backfill_minhash(cursor, num_perm, bands):
+    """Compute MinHash signatures for users with interest items but no signature yet."""
+    cursor.execute('''
+        SELECT DISTINCT user_id FROM user_interest_items
+        WHERE user_id NOT IN (SELECT user_id FROM user_minhash)
+    ''')
+    for row in cursor.fetchall():
+        update_user_minhash(cursor, row['user_id'], num_perm, bands)
+
+
+def lsh_candidates(cursor, user_id, bands, max_candidates):
+    """Return up to max_candidates users sharing an LSH bucket with user_id.
+
+    Users colliding in more bands come first, as they are more likely to be
+    similar.
+    """
+    signature = _load_signature(cursor, user_id)
+    if signature is None:
+        return []
+
+    hits = Counter()
+    for band, bucket in band_buckets(signature, bands):
+        cursor.execute('SELECT user_id FROM lsh_buckets WHERE band = ? AND bucket = ?', (band, bucket))
+        hits.update(row['user_id'] for row in cursor.fetchall())
+    hits.pop(user_id, None)
+    return [other_id for other_id, _ in hits.most_common(max_candidates)]
+
+
+@click.command('rebuild-lsh')
+@with_appcontext
+def rebuild_lsh_command():
+    """Recompute every user's MinHash signature and LSH buckets."""
+    count = run_write(rebuild_lsh_index, current_app.config['MINHASH_PERMUTATIONS'], current_app.config['LSH_BANDS'])
+    click.echo(f'Rebuilt LSH index for {count} users.')
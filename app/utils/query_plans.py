@@ -0,0 +1,176 @@
+"""EXPLAIN QUERY PLAN regression check for the blueprints' queries.
+
+Requests every blueprint route against a copy of the database while tracing
+the SQL they run, then explains each statement and reports full table scans,
+i.e. SCAN steps over a real table that don't use an index. Run it after
+changing a query or the schema:
+
+    flask --app run check-query-plans
+"""
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from app.utils.db import connect, set_statement_trace
+from app.utils.helpers import encode_cursor
+
+# Scans that are expected, by (endpoint, table), with the reason
+ALLOWED_SCANS = {
+    ('mutuals.mutuals', 'users'): 'discovery fallback walks users by rowid and stops after one page',
+    # Whichever of these runs first in a process loads the whole follow graph once
+    ('main.user_detail', 'follows'): 'loads the in-memory follow graph, once per follows version',
+    ('mutuals.mutuals', 'follows'): 'loads the in-memory follow graph, once per follows version',
+}
+
+# Extra query strings requested on top of each route's plain URL
+ROUTE_VARIANTS = {
+    'main.home': ['?sort=recent', '?sort=alphabetical', '?sort=trending', '?filter=hashtag',
+                  '?sort=recent&filter=music', '?sort=alphabetical&filter=creator', '?sort=trending&filter=hashtag'],
+    'mutuals.mutuals': ['?sort=followers', '?sort=alphabetical', '?mode=approx', '?page=2'],
+    'mutuals.search': ['?q=a', '?q=us', '?q=user'],
+    'main.get_trend_users': ['?limit=1', '?cursor=' + encode_cursor('a', 0), '?all=1'],
+    'main.get_trend_followers': ['?limit=1', '?cursor=' + encode_cursor('a', 0), '?all=1'],
+    'main.get_followers': ['?limit=1', '?cursor=' + encode_cursor('a', 0), '?all=1'],
+    'main.get_following': ['?limit=1', '?cursor=' + encode_cursor('a', 'music', None), '?all=1',
+                           '?type=user', '?type=hashtag,creator'],
+}
+
+# Routes that aren't requested: they end the session or change credentials
+SKIPPED_ENDPOINTS = {'auth.logout', 'auth.login', 'auth.register', 'admin.edit_profile',
+                     'admin.change_password', 'admin.delete_account', 'static', 'uploaded_file'}
+
+_ALIASES = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', re.IGNORECASE)
+# Trigger bodies are traced as '-- ' comments, and FTS5 reads its shadow
+# tables with statements like SELECT ... FROM 'main'.'user_search_config'
+_INTERNAL = re.compile(r"^--|'main'\.")
+_EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def full_scans(db, sql):
+    """Return the tables a statement reads in full.
+
+    That's a SCAN of a real table (not a CTE or subquery) without an index,
+    or through an index with no LIMIT to end the walk.
+    """
+    details = [row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+    # CTEs and subqueries, and the aliases the statement gives them
+    derived = {m.group(1) for m in (re.match(r'(?:MATERIALIZE|CO-ROUTINE) (\S+)', d) for d in details) if m}
+    derived.update(alias for name, alias in _ALIASES.findall(sql) if name in derived)
+    # Walking a whole index in order is only cheap when a LIMIT stops it early
+    limited = re.search(r'\bLIMIT\b', sql, re.IGNORECASE) is not None
+    scans = []
+    for detail in details:
+        m = re.match(r'SCAN (\S+)(.*)', detail)
+        if not m:
+            continue
+        name, rest = m.groups()
+        if name in derived or name.startswith('(') or name == 'CONSTANT' or 'VIRTUAL TABLE' in rest:
+            continue
+        if 'INDEX' in rest and limited:
+            continue
+        scans.append(name)
+    return scans
+
+
+def _sample_values(db):
+    """Route arguments taken from the database, so pages have data to query."""
+    def first(sql, default):
+        row = db.execute(sql).fetchone()
+        return row[0] if row and row[0] is not None else default
+
+    user_id = first('SELECT user_id FROM user_interests ORDER BY user_id LIMIT 1', 1)
+    return {
+        'user_id': user_id,
+        'other_user_id': first(f'SELECT id FROM users WHERE id != {int(user_id)} ORDER BY id LIMIT 1', 2),
+        'job_id': first('SELECT id FROM ingest_jobs ORDER BY id LIMIT 1', 1),
+        'hashtag_name': first("SELECT LTRIM(name, '#') FROM global_trends WHERE trend_type = 'hashtag' ORDER BY count DESC LIMIT 1", 'travel'),
+        'song_name': first("SELECT name FROM global_trends WHERE trend_type = 'music' ORDER BY count DESC LIMIT 1", 'song'),
+        'creator_name': first("SELECT LTRIM(name, '@') FROM global_trends WHERE trend_type = 'creator' ORDER BY count DESC LIMIT 1", 'creator'),
+        'trend_type': 'hashtag',
+    }
+
+
+def _urls(app, samples):
+    """(endpoint, method, url) for every blueprint route to exercise."""
+    urls = []
+    with app.test_request_context():
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint in SKIPPED_ENDPOINTS:
+                continue
+            args = {}
+            for name in rule.arguments:
+                if name == 'trend_name':
+                    args[name] = samples['hashtag_name']
+                elif name == 'user_id':
+                    args[name] = samples['other_user_id']
+                else:
+                    args[name] = samples[name]
+            url = url_for(rule.endpoint, **args)
+            method = 'GET' if 'GET' in rule.methods else 'POST'
+            urls.append((rule.endpoint, method, url))
+            for variant in ROUTE_VARIANTS.get(rule.endpoint, []):
+                urls.append((rule.endpoint, method, url + variant))
+    return urls
+
+
+def check_query_plans(app):
+    """Return {(endpoint, table): [statements]} for every unindexed scan found."""
+    from app import create_app
+
+    source = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+    tmp = tempfile.mkdtemp()
+    copy = os.path.join(tmp, 'plans.db')
+    backup = sqlite3.connect(copy)
+    with sqlite3.connect(source) as db:
+        db.backup(backup)
+    backup.close()
+
+    statements = []
+    set_statement_trace(statements.append)
+    try:
+        checked = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + copy,
+                              'UPLOAD_FOLDER': tmp, 'TESTING': True})
+
+        explain = connect(copy, read_only=True)
+        samples = _sample_values(explain)
+        client = checked.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = samples['user_id']
+
+        found = {}
+        seen = set()
+        for endpoint, method, url in _urls(checked, samples):
+            del statements[:]
+            client.open(url, method=method)
+            for sql in statements:
+                if sql in seen or not _EXPLAINABLE.match(sql) or _INTERNAL.search(sql):
+                    continue
+                seen.add(sql)
+                for table in full_scans(explain, sql):
+                    found.setdefault((endpoint, table), []).append(sql)
+        explain.close()
+        return found
+    finally:
+        set_statement_trace(None)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a blueprint query scans a table without an index."""
+    found = check_query_plans(current_app._get_current_object())
+    failures = {key: sqls for key, sqls in found.items() if key not in ALLOWED_SCANS}
+    for (endpoint, table), sqls in sorted(found.items()):
+        reason = ALLOWED_SCANS.get((endpoint, table))
+        label = f'allowed: {reason}' if reason else 'FULL SCAN'
+        click.echo(f'{endpoint}: {table} ({label})')
+        for sql in sqls[:3]:
+            click.echo('    ' + ' '.join(sql.split())[:200])
+    if failures:
+        raise click.ClickException(f'{len(failures)} unindexed table scans')
+    click.echo('Every blueprint query uses an index.')
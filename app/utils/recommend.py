@@ -0,0 +1,152 @@
+"""Personalized For You ranking of hashtags, songs and creators.
+
+Candidates come from precomputed structures rather than scans: the
+interest items of the user's "peers" (their stored top matches in
+user_matches, plus the users they follow), the stored item_related lists of
+the user's own items and the most popular trends of each type off the
+(trend_type, count) index. Each candidate is scored by how much of the
+user's peer group has it and how often it is liked together with the
+user's items, blended with its global popularity. Items the user already
+has or follows are left out. Ranked feeds are cached per user and
+invalidated by the 'foryou:<user_id>' cache version, which triggers bump
+when the user's interests or follows change.
+"""
+import json
+import math
+from flask import current_app
+from app.utils.db import get_db, TREND_FOLLOWS
+from app.utils.cache import VersionedCache, cache_version
+from app.utils.helpers import TREND_SOURCES
+from app.utils.matching import user_matches_source
+
+# Trend types recommended, and the prefix that turns an item name into its trend name
+FEED_TYPES = {trend_type: prefix for _, trend_type, prefix in TREND_SOURCES}
+
+# Blend of peer affinity (share of the peer group's weight with the item),
+# co-occurrence (average share of the users of each of the user's items who
+# also like it) and popularity (log count relative to the type's most
+# popular trend)
+AFFINITY_WEIGHT = 0.6
+RELATED_WEIGHT = 0.2
+POPULARITY_WEIGHT = 0.2
+
+# Peer weight of a followed user; matches weigh their match percentage / 100
+FOLLOW_WEIGHT = 1.0
+
+# Popular trends per type added to the candidates, so users without peers
+# still get a feed
+POPULAR_CANDIDATES = 50
+
+# Ranked feeds kept per process, least recently viewed dropped first
+_feeds = VersionedCache(max_entries=4096)
+
+
+def _peer_weights(cursor, user_id):
+    weights = {}
+    source, params = user_matches_source(user_id)
+    cursor.execute(f'SELECT other_id, score FROM ({source})', params)
+    for row in cursor.fetchall():
+        weights[row['other_id']] = row['score'] / 100
+    cursor.execute('SELECT following_id FROM follows WHERE follower_id = ?', (user_id,))
+    for row in cursor.fetchall():
+        weights[row['following_id']] = weights.get(row['following_id'], 0) + FOLLOW_WEIGHT
+    weights.pop(user_id, None)
+    return weights
+
+
+def _known_trends(cursor, user_id):
+    """(trend_type, name) of every trend the user already has or follows."""
+    cursor.execute('''
+        SELECT ii.kind, ii.name FROM user_interest_items uii
+        JOIN interest_items ii ON ii.id = uii.item_id
+        WHERE uii.user_id = ?
+    ''', (user_id,))
+    known = {(row['kind'], FEED_TYPES[row['kind']] + row['name']) for row in cursor.fetchall() if row['kind'] in FEED_TYPES}
+    for table, column, trend_type, prefix in TREND_FOLLOWS:
+        cursor.execute(f'SELECT {column} FROM {table} WHERE user_id = ?', (user_id,))
+        known.update((trend_type, prefix + row[0]) for row in cursor.fetchall())
+    return known
+
+
+def rank_foryou(user_id, per_type=10):
+    """Rank recommendations for user_id.
+
+    Returns {trend_type: [{'name', 'count', 'match_percent'}, ...]} with up to
+    per_type items of each type, best first.
+    """
+    cursor = get_db().cursor()
+    peers = _peer_weights(cursor, user_id)
+    total_weight = sum(peers.values())
+    known = _known_trends(cursor, user_id)
+
+    # Peer affinity: weight of the peers having each item
+    affinity = {}
+    if peers:
+        cursor.execute(f'''
+            SELECT uii.user_id, uii.kind, ii.name
+            FROM json_each(?) p
+            JOIN user_interest_items uii ON uii.user_id = p.value
+            JOIN interest_items ii ON ii.id = uii.item_id
+            WHERE uii.kind IN ({','.join('?' * len(FEED_TYPES))})
+        ''', (json.dumps(list(peers)), *FEED_TYPES))
+        for row in cursor.fetchall():
+            key = (row['kind'], FEED_TYPES[row['kind']] + row['name'])
+            affinity[key] = affinity.get(key, 0) + peers[row['user_id']]
+
+    # Co-occurrence: the related lists of all of the user's items in one lookup
+    cursor.execute(f'''
+        SELECT ii.kind, ii.name,
+               SUM(r.users * 1.0 / src.users) / (SELECT COUNT(*) FROM user_interest_items WHERE user_id = ?) as share
+        FROM user_interest_items mine
+        JOIN interest_items src ON src.id = mine.item_id
+        JOIN item_related r ON r.item_id = mine.item_id
+        JOIN interest_items ii ON ii.id = r.related_id
+        WHERE mine.user_id = ? AND ii.kind IN ({','.join('?' * len(FEED_TYPES))})
+        GROUP BY r.related_id
+    ''', (user_id, user_id, *FEED_TYPES))
+    related = {(row['kind'], FEED_TYPES[row['kind']] + row['name']): row['share'] for row in cursor.fetchall()}
+
+    # Global counts of the peer and related candidates, plus each type's popular trends
+    counts = {}
+    cursor.execute('''
+        SELECT gt.trend_type, gt.name, gt.count
+        FROM json_each(?) c
+        JOIN global_trends gt ON gt.trend_type = json_extract(c.value, '$[0]') AND gt.name = json_extract(c.value, '$[1]')
+    ''', (json.dumps(list(affinity.keys() | related.keys())),))
+    counts.update(((row['trend_type'], row['name']), row['count']) for row in cursor.fetchall())
+    top_counts = {}
+    for trend_type in FEED_TYPES:
+        cursor.execute('SELECT name, count FROM global_trends WHERE trend_type = ? ORDER BY count DESC LIMIT ?',
+                       (trend_type, POPULAR_CANDIDATES))
+        rows = cursor.fetchall()
+        top_counts[trend_type] = rows[0]['count'] if rows else 0
+        counts.update(((trend_type, row['name']), row['count']) for row in rows)
+
+    feed = {trend_type: [] for trend_type in FEED_TYPES}
+    for key in counts.keys() | affinity.keys() | related.keys():
+        if key in known:
+            continue
+        trend_type, name = key
+        count = max(counts.get(key, 0), 0)
+        share = affinity.get(key, 0) / total_weight if total_weight else 0
+        popularity = math.log1p(count) / math.log1p(top_counts[trend_type]) if top_counts[trend_type] > 0 else 0
+        score = (AFFINITY_WEIGHT * share + RELATED_WEIGHT * min(related.get(key, 0), 1)
+                 + POPULARITY_WEIGHT * min(popularity, 1))
+        feed[trend_type].append({'name': name, 'count': count, 'match_percent': round(score * 100), 'score': score})
+
+    for trend_type, items in feed.items():
+        items.sort(key=lambda item: (-item['score'], -item['count'], item['name']))
+        del items[per_type:]
+    return feed
+
+
+def feed_version(user_id):
+    """Cache version of user_id's feed, moved by changes to their interests or follows."""
+    return cache_version(f'foryou:{user_id}')
+
+
+def foryou_feed(user_id, version):
+    """rank_foryou for user_id, cached until version moves or FORYOU_CACHE_TTL passes."""
+    config = current_app.config
+    return _feeds.get(user_id, version, config['FORYOU_CACHE_TTL'],
+                      lambda: rank_foryou(user_id, config['FORYOU_PER_TYPE']))
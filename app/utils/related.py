@@ -0,0 +1,166 @@
+"""Item-item co-occurrence: "people who like X also like Y".
+
+item_related holds, for every interest item, the top-N other items the most
+users have alongside it, with the exact number of those users. Divided by
+interest_items.users (the item's own user count) that is the share of X's
+users who also like Y. The compute-related command rebuilds the table in
+batch; refresh_item_related applies each upload's changes to it in place,
+which can leave lists slightly off until the next rebuild.
+"""
+import json
+from collections import Counter
+from flask import current_app
+from app.utils.db import get_db
+
+# Items sharing users with :item_id, most shared users first, read off the
+# (item_id, user_id) index and each of those users' own items
+RELATED_QUERY = '''
+    SELECT o.item_id as related_id, COUNT(*) as users
+    FROM user_interest_items m
+    JOIN user_interest_items o ON o.user_id = m.user_id
+    WHERE m.item_id = :item_id AND o.item_id != :item_id
+    GROUP BY o.item_id
+    ORDER BY users DESC, related_id
+    LIMIT :limit
+'''
+
+# Number of users who have both :item_id and :other_id, read off the
+# (item_id, user_id) index and the user_interest_items primary key
+SHARED_USERS_QUERY = '''
+    SELECT COUNT(*) FROM user_interest_items m
+    JOIN user_interest_items o ON o.user_id = m.user_id AND o.item_id = :other_id
+    WHERE m.item_id = :item_id
+'''
+
+# Stored related items of the (:kind, :name) item, with the share of its
+# users who have each of them
+RELATED_ITEMS_QUERY = '''
+    SELECT ii.kind, ii.name, r.users, r.users * 100 / src.users as percent
+    FROM interest_items src
+    JOIN item_related r ON r.item_id = src.id
+    JOIN interest_items ii ON ii.id = r.related_id
+    WHERE src.kind = :kind AND src.name = :name
+    ORDER BY r.users DESC, r.related_id
+    LIMIT :limit
+'''
+
+
+def store_item_related(cursor, item_id, top_n):
+    """Recompute item_id's rows in item_related from scratch."""
+    cursor.execute('DELETE FROM item_related WHERE item_id = ?', (item_id,))
+    cursor.execute(RELATED_QUERY, {'item_id': item_id, 'limit': top_n})
+    cursor.executemany(
+        'INSERT INTO item_related (item_id, related_id, users) VALUES (?, ?, ?)',
+        [(item_id, row['related_id'], row['users']) for row in cursor.fetchall()]
+    )
+
+
+def _item_ids(cursor, pairs):
+    cursor.execute('''
+        SELECT ii.id FROM json_each(?) p
+        JOIN interest_items ii ON ii.kind = json_extract(p.value, '$[0]') AND ii.name = json_extract(p.value, '$[1]')
+    ''', (json.dumps(list(pairs)),))
+    return {row['id'] for row in cursor.fetchall()}
+
+
+def refresh_item_related(cursor, user_id, added, removed, top_n):
+    """Bring item_related up to date after user_id's interest items changed.
+
+    added and removed are the (kind, name) pairs from sync_interest_items,
+    already applied. Each added item gains one shared user with every other
+    item the user has, and each removed item loses one with every item the
+    user had, in both items' lists; the lists are then trimmed to top_n.
+
+    A pair's old count is known when either list holds it, or is 0 when
+    either list has fewer than top_n entries (such a list holds every item
+    sharing a user). Otherwise both lists are full without it, so it has at
+    most the lower of their worst counts; it is only counted, with one
+    indexed lookup, when a gain could lift it into a list. An entry that
+    goes down keeps its place over outside items that may now have as
+    many users, which compute-related corrects. A full list that loses
+    entries is recomputed, to keep short lists complete.
+    """
+    added_ids, removed_ids = _item_ids(cursor, added), _item_ids(cursor, removed)
+    if not added_ids and not removed_ids:
+        return
+
+    cursor.execute('SELECT item_id FROM user_interest_items WHERE user_id = ?', (user_id,))
+    current = {row['item_id'] for row in cursor.fetchall()}
+    previous = (current - added_ids) | removed_ids
+
+    # Shared-user changes per (item_id, related_id), counting pairs of two
+    # changed items once in each direction
+    deltas = Counter()
+    for changed, items, step in ((added_ids, current, 1), (removed_ids, previous, -1)):
+        for item_id in changed:
+            for other in items - {item_id}:
+                deltas[item_id, other] += step
+                if other not in changed:
+                    deltas[other, item_id] += step
+
+    cursor.execute('''
+        SELECT r.item_id, r.related_id, r.users
+        FROM json_each(?) k
+        JOIN item_related r ON r.item_id = k.value
+    ''', (json.dumps(list(current | removed_ids)),))
+    stored = {item_id: {} for item_id in current | removed_ids}
+    for row in cursor.fetchall():
+        stored[row['item_id']][row['related_id']] = row['users']
+
+    lists, shared = {}, {}
+    for (item_id, other), delta in deltas.items():
+        if other in stored[item_id]:
+            users = stored[item_id][other]
+        elif item_id in stored[other]:
+            users = stored[other][item_id]
+        elif len(stored[item_id]) < top_n or len(stored[other]) < top_n:
+            users = 0
+        elif delta > 0 and min(stored[other].values()) + delta >= min(stored[item_id].values()):
+            pair = frozenset((item_id, other))
+            if pair not in shared:
+                cursor.execute(SHARED_USERS_QUERY, {'item_id': item_id, 'other_id': other})
+                shared[pair] = cursor.fetchone()[0]
+            users = shared[pair] - delta
+        else:
+            continue
+        lists.setdefault(item_id, dict(stored[item_id]))[other] = users + delta
+
+    upserts, evicted, recompute = [], [], []
+    for item_id, entries in lists.items():
+        old = stored[item_id]
+        best = sorted(((other, users) for other, users in entries.items() if users > 0),
+                      key=lambda entry: (-entry[1], entry[0]))[:top_n]
+        if len(old) >= top_n > len(best):
+            recompute.append(item_id)
+            continue
+        upserts.extend((item_id, other, users) for other, users in best if old.get(other) != users)
+        evicted.extend((item_id, other) for other in old.keys() - dict(best).keys())
+
+    cursor.executemany('DELETE FROM item_related WHERE item_id = ? AND related_id = ?', evicted)
+    cursor.executemany('INSERT OR REPLACE INTO item_related (item_id, related_id, users) VALUES (?, ?, ?)', upserts)
+    for item_id in recompute:
+        store_item_related(cursor, item_id, top_n)
+
+
+def backfill_item_related(cursor, top_n):
+    """Compute lists for items that have users but no stored related items yet."""
+    cursor.execute('''
+        SELECT id FROM interest_items
+        WHERE users > 0 AND id NOT IN (SELECT item_id FROM item_related)
+    ''')
+    for row in cursor.fetchall():
+        store_item_related(cursor, row['id'], top_n)
+
+
+def related_items(kind, name, limit=None):
+    """Items most often liked together with the (kind, name) interest item.
+
+    One lookup of the stored list. Returns dicts with kind, name, users (how
+    many users have both) and percent (the share of the item's users who
+    also have the related one), best first.
+    """
+    cursor = get_db().cursor()
+    cursor.execute(RELATED_ITEMS_QUERY, {
+        'kind': kind, 'name': name, 'limit': limit or current_app.config['RELATED_TOP_N']
+    })
+    return [dict(row) for row in cursor.fetchall()]
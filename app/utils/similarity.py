@@ -0,0 +1,232 @@
+"""Batch all-pairs interest similarity.
+
+Builds a sparse user x item matrix from user_interest_items and scores users
+against each other with sparse matrix products, a block of rows at a time, to
+precompute each user's top-N matches into user_matches. The transposed
+product gives the item x item co-occurrence counts behind item_related.
+Requires numpy and scipy, which the web app itself does not need.
+"""
+import click
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from flask.cli import with_appcontext
+from app.utils.db import run_write, transaction, INTEREST_COLUMNS
+
+KINDS = [kind for _, kind in INTEREST_COLUMNS]
+
+# Matrices shared with worker processes, set by _init_worker
+_matrix = None
+_kind_counts = None
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+        import scipy.sparse as sparse
+    except ImportError as e:
+        raise RuntimeError('Batch similarity needs numpy and scipy: pip install numpy scipy') from e
+    return np, sparse
+
+
+def load_interest_matrix(db):
+    """Load user_interest_items as matrices.
+
+    Returns (user_ids, item_ids, matrix, kind_counts): user_ids and item_ids
+    map row and column numbers to user and item ids, matrix is a binary CSR
+    user x item matrix and kind_counts is a dense users x kinds array of how
+    many items each user has of each kind.
+    """
+    np, sparse = _require_numpy()
+
+    cursor = db.cursor()
+    cursor.execute('SELECT user_id, kind, item_id FROM user_interest_items ORDER BY user_id')
+    rows = cursor.fetchall()
+
+    user_ids = np.unique(np.fromiter((row['user_id'] for row in rows), dtype=np.int64, count=len(rows)))
+    user_index = np.searchsorted(user_ids, np.fromiter((row['user_id'] for row in rows), dtype=np.int64, count=len(rows)))
+    item_ids = np.fromiter((row['item_id'] for row in rows), dtype=np.int64, count=len(rows))
+    kind_index = np.fromiter((KINDS.index(row['kind']) for row in rows), dtype=np.int64, count=len(rows))
+
+    columns, item_index = np.unique(item_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (user_index, item_index)),
+        shape=(len(user_ids), len(columns))
+    )
+    kind_counts = np.zeros((len(user_ids), len(KINDS)), dtype=np.int32)
+    np.add.at(kind_counts, (user_index, kind_index), 1)
+    return user_ids, columns, matrix, kind_counts
+
+
+def score_block(matrix, kind_counts, start, stop, top_n):
+    """Score rows start:stop against every user and keep each row's top_n.
+
+    Returns arrays (rows, others, scores, shared) of row numbers into the
+    matrix, ordered by row and then best match first, with each pair's match
+    percentage and shared item count. Scores follow
+    calculate_interest_match: shared items * 100 // sum over kinds of the
+    larger item count.
+    """
+    np, _ = _require_numpy()
+
+    shared = (matrix[start:stop] @ matrix.T).tocoo()
+    rows = shared.row.astype(np.int64) + start
+    others = shared.col.astype(np.int64)
+    counts = shared.data
+
+    not_self = rows != others
+    rows, others, counts = rows[not_self], others[not_self], counts[not_self]
+
+    possible = np.maximum(kind_counts[rows], kind_counts[others]).sum(axis=1)
+    scores = counts * 100 // possible
+
+    # Order by row, then score, shared items and user (same tie-break as top_matches)
+    order = np.lexsort((others, -counts, -scores, rows))
+    rows, others, scores, counts = rows[order], others[order], scores[order], counts[order]
+
+    # Position of each entry within its row, to cut every row at top_n
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - row_starts < top_n
+    return rows[keep], others[keep], scores[keep], counts[keep]
+
+
+def _init_worker(matrix, kind_counts):
+    global _matrix, _kind_counts
+    _matrix, _kind_counts = matrix, kind_counts
+
+
+def _score_block_task(args):
+    start, stop, top_n = args
+    return score_block(_matrix, _kind_counts, start, stop, top_n)
+
+
+def compute_all_matches(db, top_n=50, block_size=256, workers=1):
+    """Recompute user_matches for every user with interests.
+
+    Rows are scored in blocks of block_size users so memory stays bounded by
+    the block's products, and blocks are spread over `workers` processes.
+    Returns the number of users scored.
+    """
+    user_ids, _, matrix, kind_counts = load_interest_matrix(db)
+    blocks = [(start, min(start + block_size, len(user_ids)), top_n)
+              for start in range(0, len(user_ids), block_size)]
+
+    def write(results):
+        cursor = db.cursor()
+        cursor.execute('DELETE FROM user_matches')
+        for rows, others, scores, shared in results:
+            cursor.executemany(
+                'INSERT INTO user_matches (user_id, other_id, score, shared) VALUES (?, ?, ?, ?)',
+                zip(user_ids[rows].tolist(), user_ids[others].tolist(), scores.tolist(), shared.tolist())
+            )
+        # Users without interests have an empty list, which is computed too
+        cursor.execute('INSERT OR REPLACE INTO user_matches_state (user_id) SELECT id FROM users')
+
+    with transaction(db):
+        if workers > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(matrix, kind_counts)) as executor:
+                write(executor.map(_score_block_task, blocks))
+        else:
+            write(score_block(matrix, kind_counts, start, stop, n) for start, stop, n in blocks)
+
+    return len(user_ids)
+
+
+def related_block(item_matrix, start, stop, top_n):
+    """Count co-occurrences of items start:stop with every item and keep each row's top_n.
+
+    item_matrix is the item x user matrix. Returns arrays (rows, others,
+    users) of row numbers into it, ordered by row and then most shared
+    users first, the same order as RELATED_QUERY.
+    """
+    np, _ = _require_numpy()
+
+    shared = (item_matrix[start:stop] @ item_matrix.T).tocoo()
+    rows = shared.row.astype(np.int64) + start
+    others = shared.col.astype(np.int64)
+    users = shared.data
+
+    not_self = rows != others
+    rows, others, users = rows[not_self], others[not_self], users[not_self]
+
+    order = np.lexsort((others, -users, rows))
+    rows, others, users = rows[order], others[order], users[order]
+
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - row_starts < top_n
+    return rows[keep], others[keep], users[keep]
+
+
+def _related_block_task(args):
+    start, stop, top_n = args
+    return related_block(_matrix, start, stop, top_n)
+
+
+def compute_all_related(db, top_n=20, block_size=1024, workers=1):
+    """Recompute item_related for every item from the item x item product.
+
+    Blocks of block_size items are multiplied against all items, over
+    `workers` processes like compute_all_matches. Returns the number of
+    items counted.
+    """
+    _, item_ids, matrix, _ = load_interest_matrix(db)
+    item_matrix = matrix.T.tocsr()
+    blocks = [(start, min(start + block_size, len(item_ids)), top_n)
+              for start in range(0, len(item_ids), block_size)]
+
+    def write(results):
+        cursor = db.cursor()
+        cursor.execute('DELETE FROM item_related')
+        for rows, others, users in results:
+            cursor.executemany(
+                'INSERT INTO item_related (item_id, related_id, users) VALUES (?, ?, ?)',
+                zip(item_ids[rows].tolist(), item_ids[others].tolist(), users.tolist())
+            )
+
+    with transaction(db):
+        if workers > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(item_matrix, None)) as executor:
+                write(executor.map(_related_block_task, blocks))
+        else:
+            write(related_block(item_matrix, start, stop, n) for start, stop, n in blocks)
+
+    return len(item_ids)
+
+
+@click.command('compute-matches')
+@click.option('--top-n', type=int, default=None, help='Matches to keep per user (default: MATCHES_TOP_N).')
+@click.option('--block-size', type=int, default=256, show_default=True, help='Users scored per matrix product.')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: INGEST_PARSE_WORKERS).')
+@with_appcontext
+def compute_matches_command(top_n, block_size, workers):
+    """Precompute every user's best interest matches into user_matches."""
+    config = current_app.config
+    count = run_write(
+        lambda cursor: compute_all_matches(
+            cursor.connection,
+            top_n=top_n or config['MATCHES_TOP_N'],
+            block_size=block_size,
+            workers=workers or config['INGEST_PARSE_WORKERS']
+        )
+    )
+    click.echo(f'Computed matches for {count} users.')
+
+
+@click.command('compute-related')
+@click.option('--top-n', type=int, default=None, help='Related items to keep per item (default: RELATED_TOP_N).')
+@click.option('--block-size', type=int, default=1024, show_default=True, help='Items counted per matrix product.')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: INGEST_PARSE_WORKERS).')
+@with_appcontext
+def compute_related_command(top_n, block_size, workers):
+    """Precompute every item's most co-occurring items into item_related."""
+    config = current_app.config
+    count = run_write(
+        lambda cursor: compute_all_related(
+            cursor.connection,
+            top_n=top_n or config['RELATED_TOP_N'],
+            block_size=block_size,
+            workers=workers or config['INGEST_PARSE_WORKERS']
+        )
+    )
+    click.echo(f'Computed related items for {count} items.')
@@ -0,0 +1,120 @@
+"""Benchmark approximate (MinHash/LSH) mutual matching against exact matching.
+
+Builds a database of synthetic users in interest communities, with a few
+items (like #travel) almost everyone has, then for a sample of users compares
+approx_top_matches with the exact ranking from calculate_interest_match.
+Recall is the share of the approximate top-k whose exact match percentage is
+at least that of the exact k-th best user, so ties don't count as misses.
+Each LSH_BANDS setting is timed against the inverted-index top_matches.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_mutuals [--users 2000] [--queries 20] [--top 20] [--bands 8 16 32]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config import Config
+from app.utils.db import close_db, init_db, run_write
+from app.utils.helpers import calculate_interest_match, sync_interest_items
+from app.utils.matching import top_matches, approx_top_matches
+from app.utils.minhash import rebuild_lsh_index
+
+POPULAR = ['travel', 'fyp', 'foodie']
+
+
+def make_interests(rng, community):
+    def pick(prefix, pool, k):
+        return rng.sample([f'{prefix}{community}_{i}' for i in range(pool)], k)
+
+    return {
+        'hashtags': [tag for tag in POPULAR if rng.random() < 0.8] + pick('tag', 20, 10),
+        'music_liked': pick('Song ', 10, 5),
+        'trends_followed': [],
+        'celebrities_followed': pick('@creator', 10, 5),
+    }
+
+
+def populate(cursor, users, communities, seed=1):
+    rng = random.Random(seed)
+    for n in range(users):
+        cursor.execute(
+            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+            (f'bench{n}', f'bench{n}@example.com', 'x')
+        )
+        user_id = cursor.lastrowid
+        interests = make_interests(rng, rng.randrange(communities))
+        cursor.execute('''
+            INSERT INTO user_interests (user_id, hashtags, music_liked, trends_followed, celebrities_followed)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, json.dumps(interests['hashtags']), json.dumps(interests['music_liked']),
+              json.dumps(interests['trends_followed']), json.dumps(interests['celebrities_followed'])))
+        sync_interest_items(cursor, user_id, interests)
+    cursor.execute('SELECT user_id FROM user_interests')
+    return [row['user_id'] for row in cursor.fetchall()]
+
+
+def exact_scores(user_id, user_ids):
+    return {other_id: calculate_interest_match(user_id, other_id) for other_id in user_ids if other_id != user_id}
+
+
+def timed(rank, queries, top):
+    start = time.perf_counter()
+    results = {user_id: rank(user_id, top)[0] for user_id in queries}
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def run(users, queries, top, bands_options):
+    tmp = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+    init_db(app)
+
+    with app.app_context():
+        user_ids = run_write(populate, users, max(users // 100, 2))
+        sample = random.Random(2).sample(user_ids, queries)
+
+        print(f'{len(user_ids)} users, {queries} queries, top {top}')
+        start = time.perf_counter()
+        truth = {user_id: exact_scores(user_id, user_ids) for user_id in sample}
+        print(f'  calculate_interest_match: {(time.perf_counter() - start) * 1000 / queries:8.1f} ms per user (all pairs)')
+
+        _, exact_ms = timed(top_matches, sample, top)
+        print(f'  top_matches (exact):      {exact_ms:8.1f} ms per user')
+
+        for bands in bands_options:
+            app.config['LSH_BANDS'] = bands
+            run_write(rebuild_lsh_index, app.config['MINHASH_PERMUTATIONS'], bands)
+
+            results, approx_ms = timed(approx_top_matches, sample, top)
+            found = wanted = 0
+            for user_id, matches in results.items():
+                scores = sorted(truth[user_id].values(), reverse=True)
+                kth = scores[min(top, len(scores)) - 1]
+                wanted += sum(1 for score in scores[:top] if score > 0)
+                found += sum(1 for other_id, score in matches if score > 0 and score >= kth)
+                assert all(truth[user_id][other_id] == score for other_id, score in matches)
+
+            rows = app.config['MINHASH_PERMUTATIONS'] // bands
+            print(f'  approx {bands:>3} bands x {rows:>2} rows: {approx_ms:8.1f} ms per user, '
+                  f'recall@{top} {found / max(wanted, 1):.2f}')
+        close_db()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--bands', type=int, nargs='+', default=[8, 16, 32])
+    args = parser.parse_args()
+    run(args.users, args.queries, args.top, args.bands)
@@ -0,0 +1,94 @@
+"""Benchmark global_trends writes for one large activity log upload.
+
+Compares the old per-item INSERT ... ON CONFLICT loop (one implicit
+transaction per statement on an autocommit connection) with the batched
+update_global_trends (one executemany in one explicit transaction).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_trends [--items 5000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config import Config
+from app.utils.db import connect, init_db, transaction
+from app.utils.helpers import update_global_trends
+
+
+def make_interests(items):
+    return {
+        'hashtags': [f'tag{i}' for i in range(items // 4)],
+        'music_liked': [f'Song {i} - Artist {i}' for i in range(items // 4)],
+        'trends_followed': [],
+        'celebrities_followed': [f'@creator{i}' for i in range(items // 2)],
+    }
+
+
+def legacy_update_global_trends(db, interests):
+    """The per-item implementation update_global_trends replaced."""
+    cursor = db.cursor()
+    sources = (('hashtags', 'hashtag', '#'), ('music_liked', 'music', ''), ('celebrities_followed', 'creator', ''))
+    for key, trend_type, prefix in sources:
+        for name in interests[key]:
+            cursor.execute('''
+                INSERT INTO global_trends (trend_type, name, count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(trend_type, name) DO UPDATE SET
+                count = count + 1,
+                last_updated = CURRENT_TIMESTAMP
+            ''', (trend_type, prefix + name))
+    db.commit()
+
+
+def wal_frames(db):
+    """Number of frames appended to the WAL since the last truncation."""
+    return db.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()[1]
+
+
+def run(items, repeat):
+    tmp = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+    init_db(app)
+    interests = make_interests(items)
+
+    # A plain writable connection, as the writer thread would use
+    db = connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
+
+    results = {}
+    for label, update in (('per-item', legacy_update_global_trends), ('batched', None)):
+        timings = []
+        for _ in range(repeat):
+            db.execute('DELETE FROM global_trends')
+            db.execute('DELETE FROM trend_contributions')
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            start = time.perf_counter()
+            if update is None:
+                with transaction(db):
+                    update_global_trends(db.cursor(), 1, interests)
+            else:
+                update(db, interests)
+            timings.append(time.perf_counter() - start)
+            frames = wal_frames(db)
+        results[label] = (min(timings), frames)
+
+    print(f'{items} trend items, best of {repeat}')
+    for label, (seconds, frames) in results.items():
+        print(f'  {label:>8}: {seconds * 1000:8.1f} ms spent writing, {frames} WAL frames written')
+    print(f'  speedup: {results["per-item"][0] / results["batched"][0]:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.items, args.repeat)
@@ -0,0 +1,86 @@
+"""Benchmark concurrent follow writes: one connection per request vs the writer thread.
+
+Each of --threads threads inserts --writes follows. The old way gives every
+thread its own autocommit connection, so each insert is its own transaction
+and threads contend for the SQLite write lock. The new way queues the inserts
+to the single writer thread, which commits whatever is queued as one group
+transaction.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_writes [--threads 16] [--writes 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config import Config
+from app.utils.db import connect, init_db, execute_write, get_writer
+
+
+def follow_sql(thread, n):
+    return 'INSERT INTO follows (follower_id, following_id) VALUES (?, ?)', (thread * 100000 + n, thread)
+
+
+def per_connection(app, thread, writes, latencies):
+    db = connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
+    for n in range(writes):
+        start = time.perf_counter()
+        db.execute(*follow_sql(thread, n))
+        latencies.append(time.perf_counter() - start)
+    db.close()
+
+
+def through_writer(app, thread, writes, latencies):
+    with app.app_context():
+        for n in range(writes):
+            start = time.perf_counter()
+            execute_write(*follow_sql(thread, n))
+            latencies.append(time.perf_counter() - start)
+
+
+def run(threads, writes):
+    tmp = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+    init_db(app)
+    db = connect(app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
+
+    print(f'{threads} threads x {writes} follow inserts')
+    results = {}
+    for label, write in (('per-connection', per_connection), ('writer thread', through_writer)):
+        db.execute('DELETE FROM follows')
+        latencies = []
+        workers = [threading.Thread(target=write, args=(app, thread, writes, latencies)) for thread in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - start
+        results[label] = seconds
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f'  {label:>14}: {threads * writes / seconds:8.0f} writes/s, '
+              f'p99 {p99:6.2f} ms, max {latencies[-1] * 1000:7.2f} ms per write')
+
+    with app.app_context():
+        stats = get_writer().stats()
+    print(f'  writer thread committed {stats["writes"]} writes in {stats["batches"]} transactions '
+          f'(largest batch {stats["largest_batch"]})')
+    print(f'  speedup: {results["per-connection"] / results["writer thread"]:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args()
+    run(args.threads, args.writes)
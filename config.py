@@ -12,3 +12,64 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
     
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+
+    # SQLite connections kept open per process, how long a request waits for
+    # one when all are busy, and prepared statements cached per connection
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+    DB_POOL_TIMEOUT = 30.0
+    DB_STATEMENT_CACHE = 256
+
+    # Memory-mapped I/O size for read connections, and how many queued writes
+    # the single writer thread commits together in one transaction
+    DB_MMAP_SIZE = 256 * 1024 * 1024
+    DB_WRITE_BATCH_SIZE = 64
+
+    # Number of worker processes that parse uploaded activity logs in the background
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+
+    # Processes used to parse the members of a single export, and the export
+    # size (uncompressed bytes) below which members are parsed inline instead
+    INGEST_PARSE_WORKERS = int(os.environ.get('INGEST_PARSE_WORKERS', os.cpu_count() or 1))
+    INGEST_PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+    # Seconds after which a queued or running ingest job is treated as failed
+    # (its process most likely died); such jobs are marked failed at startup
+    INGEST_JOB_TIMEOUT = 30 * 60
+
+    # Number of best matches stored per user in user_matches
+    MATCHES_TOP_N = 50
+
+    # Related items stored per interest item in item_related ("people who
+    # like X also like Y"). Run `flask compute-related` after changing it.
+    RELATED_TOP_N = 20
+
+    # MinHash/LSH settings for approximate mutual matching. The signature is
+    # cut into LSH_BANDS bands of MINHASH_PERMUTATIONS / LSH_BANDS rows: more
+    # bands find more of the similar users but produce more candidates to
+    # score. Run `flask rebuild-lsh` after changing either value.
+    MINHASH_PERMUTATIONS = 64
+    LSH_BANDS = 16
+    LSH_MAX_CANDIDATES = 500
+
+    # How /mutuals ranks users: 'exact' or 'approx' (overridable with ?mode=)
+    MUTUALS_MODE = os.environ.get('MUTUALS_MODE', 'exact')
+
+    # Friends-of-friends suggestions on /mutuals: how many to show and how
+    # many follow hops out to look for them
+    FOLLOW_SUGGESTIONS = 10
+    FOLLOW_SUGGESTION_DEPTH = 2
+
+    # Seconds a worker keeps a home/For You trend listing. Entries are also
+    # dropped as soon as global_trends changes, via the 'trends' cache version.
+    TRENDS_CACHE_TTL = 60
+
+    # "Trending now" sort on /home: trend count changes over the last
+    # TRENDING_WINDOW_HOURS, each weighted down by half every
+    # TRENDING_HALF_LIFE_HOURS
+    TRENDING_WINDOW_HOURS = 48
+    TRENDING_HALF_LIFE_HOURS = 6
+
+    # Recommendations per type on /foryou, and how long a worker keeps a
+    # user's ranked feed when their interests and follows don't change
+    FORYOU_PER_TYPE = 10
+    FORYOU_CACHE_TTL = 300
@@ -0,0 +1,26 @@
+import io
+import json
+import pytest
+from app.utils.ingest import JSONStreamReader, parse_activity_member
+
+DOCUMENT = '{"x": [-25000000000.0, 1.5e-3, 2E+10, 7], "likes": [1, 2.25, true, null], "comments": []}'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 8])
+def test_scalars_split_across_chunks(chunk_size):
+    reader = JSONStreamReader(io.StringIO(DOCUMENT), chunk_size=chunk_size)
+    values = {}
+    for key in reader.iter_object():
+        values[key] = list(reader.iter_array())
+    assert values == json.loads(DOCUMENT)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3])
+def test_scalar_at_end_of_document(chunk_size):
+    reader = JSONStreamReader(io.StringIO('-1.25e3'), chunk_size=chunk_size)
+    assert reader.read_value() == -1250.0
+
+
+def test_member_with_split_float_keeps_its_counts():
+    raw = io.BytesIO(b'{"x": [-25000000000.0], "likes": [1]}')
+    assert parse_activity_member(raw, chunk_size=1) == {'likes': 1}
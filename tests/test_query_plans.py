@@ -0,0 +1,30 @@
+from app import create_app
+from app.utils.db import get_db, run_write
+from app.utils.helpers import update_global_trends, sync_interest_items
+from app.utils.ingest import empty_interests
+from app.utils.query_plans import ALLOWED_SCANS, check_query_plans
+
+
+def _populate(cursor, user_ids):
+    for i, user_id in enumerate(user_ids):
+        interests = empty_interests()
+        interests['hashtags'] = [f'tag{k}' for k in range(i, i + 4)]
+        interests['music_liked'] = [f'Song {k % 3}' for k in range(i, i + 2)]
+        interests['celebrities_followed'] = [f'@creator{i % 2}']
+        update_global_trends(cursor, user_id, interests)
+        sync_interest_items(cursor, user_id, interests)
+        cursor.execute('INSERT OR IGNORE INTO follows (follower_id, following_id) VALUES (?, ?)',
+                       (user_id, user_ids[(i + 1) % len(user_ids)]))
+        cursor.execute('INSERT OR IGNORE INTO hashtag_follows (user_id, hashtag_name) VALUES (?, ?)',
+                       (user_id, f'tag{i}'))
+
+
+def test_blueprint_queries_use_indexes(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "plans.db"}',
+                      'UPLOAD_FOLDER': str(tmp_path), 'TESTING': True})
+    with app.app_context():
+        user_ids = [row['id'] for row in get_db().execute('SELECT id FROM users ORDER BY id')]
+        run_write(_populate, user_ids)
+
+    found = check_query_plans(app)
+    assert {key: sqls for key, sqls in found.items() if key not in ALLOWED_SCANS} == {}